@@ -0,0 +1,343 @@
+'''
+Benchmarks for the hot paths of DiscountedCashFlow.py.
+
+Synthetic payloads shaped like the Financial Modeling Prep responses are generated for
+1, 100 and 10,000 tickers. Each stage of the valuation is timed on them, and the whole
+pipeline runs against the on-disk response cache in offline mode, so no network access
+or API key is needed. Results are reported as tickers per second and peak memory, and
+can be compared against a stored baseline to catch regressions. The time it takes a fresh
+interpreter to import the module is measured too, along with any of the slow optional
+libraries (pandas, matplotlib) that the import pulled in.
+
+Usage:
+    python Benchmark.py                       # run and compare against the baseline
+    python Benchmark.py --save-baseline       # run and store the results as the baseline
+    python Benchmark.py --sizes 1 100 --threshold 0.3 --threshold pipeline=0.5
+
+'''
+
+# Imports
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import DiscountedCashFlow as dcf
+
+DEFAULT_SIZES = (1, 100, 10000)
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+# A stage counts as a regression once its throughput drops by more than this fraction
+DEFAULT_THRESHOLD = 0.2
+
+# Libraries the valuation core must not import up front
+LAZY_MODULES = ("pandas", "matplotlib")
+
+# Years of statements and of daily prices generated for every ticker
+STATEMENT_YEARS = 10
+PRICE_YEARS = 2
+
+# Builds the payloads of every endpoint in ENDPOINT_URLS for one made up company, with
+# the same field names as the real API and numbers in a realistic range
+def synthetic_payloads(ticker, seed=0, statementYears=STATEMENT_YEARS, priceYears=PRICE_YEARS):
+    generator = random.Random(str(seed) + ticker)
+    size = 10 ** generator.uniform(8, 11.5)
+    growth = generator.uniform(-0.05, 0.2)
+    lastFiling = datetime.date(2022, generator.randint(1, 12), generator.randint(1, 28))
+
+    balanceSheet, enterpriseValue, incomeStatement, reportedBS = [], [], [], []
+    for year in range(statementYears):
+        date = lastFiling.replace(year=lastFiling.year - year).isoformat()
+        scale = size * (1 + growth) ** -year * generator.uniform(0.9, 1.1)
+        revenue = scale
+        ebitda = revenue * generator.uniform(0.1, 0.4)
+        shares = size / generator.uniform(20, 200)
+        balanceSheet.append({
+            "date": date, "symbol": ticker, "reportedCurrency": "USD", "calendarYear": date[:4], "period": "FY",
+            "cashAndCashEquivalents": scale * generator.uniform(0.05, 0.3),
+            "otherCurrentAssets": scale * generator.uniform(0.01, 0.1),
+            "totalCurrentAssets": scale * generator.uniform(0.3, 0.8),
+            "otherNonCurrentAssets": scale * generator.uniform(0.05, 0.3),
+            "totalCurrentLiabilities": scale * generator.uniform(0.2, 0.7),
+            "longTermDebt": scale * generator.uniform(0.1, 0.6),
+            "netDebt": scale * generator.uniform(-0.1, 0.4),
+        })
+        enterpriseValue.append({
+            "date": date, "symbol": ticker, "stockPrice": size / shares, "numberOfShares": shares,
+            "marketCapitalization": size, "enterpriseValue": size * generator.uniform(1, 1.3),
+        })
+        incomeStatement.append({
+            "date": date, "symbol": ticker, "reportedCurrency": "USD", "calendarYear": date[:4], "period": "FY",
+            "revenue": revenue, "operatingExpenses": revenue * generator.uniform(0.1, 0.3), "ebitda": ebitda,
+            "incomeTaxExpense": ebitda * generator.uniform(0.1, 0.25),
+        })
+        reportedBS.append({"date": date, "symbol": ticker, "period": "FY", "commercialpaper": scale * generator.uniform(0, 0.02)})
+
+    historical = []
+    price = generator.uniform(10, 500)
+    day = lastFiling + datetime.timedelta(days=30)
+    end = day - datetime.timedelta(days=365 * priceYears)
+    while day > end:
+        if day.weekday() < 5:
+            historical.append({"date": day.isoformat(), "close": round(price, 2)})
+            price *= 1 + generator.gauss(0, 0.02)
+        day -= datetime.timedelta(days=1)
+
+    return {
+        "balanceSheet": balanceSheet,
+        "outstandingShares": [{"symbol": ticker, "date": lastFiling.isoformat(), "outstandingShares": enterpriseValue[0]["numberOfShares"]}],
+        "enterpriseValue": enterpriseValue,
+        "incomeStatement": incomeStatement,
+        "profile": [{"symbol": ticker, "beta": generator.uniform(0.5, 2), "price": historical[0]["close"]}],
+        "reportedBS": reportedBS,
+        "historicalPrice": {"symbol": ticker, "historical": historical},
+    }
+
+def ticker_names(count):
+    return ["SYN%05d" % index for index in range(count)]
+
+# A FetchSession that already holds its payloads
+def preloaded_session(ticker, payloads):
+    session = dcf.FetchSession(ticker)
+    session.payloads = payloads
+    return session
+
+# Writes the synthetic payloads into the response cache the same way a real download would
+def fill_cache(payloadsByTicker):
+    for ticker, payloads in payloadsByTicker.items():
+        for endpoint, payload in payloads.items():
+            _, key = dcf.cache_key(dcf.ENDPOINT_URLS[endpoint].format(ticker=ticker))
+            dcf.write_cache(key, json.dumps(payload))
+
+# Every benchmarked stage. A stage gets the tickers, their payloads and the metrics already
+# extracted from them, and does its work once for every ticker
+def stage_isolate_data(tickers, payloads, prepared):
+    for ticker in tickers:
+        session = preloaded_session(ticker, payloads[ticker])
+        dcf.isolate_data(dcf.pull_data(ticker, session))
+        dcf.isolate_data_prev_year(dcf.pull_data_prev_year(ticker, session))
+
+def stage_share_price(tickers, payloads, prepared):
+    for ticker in tickers:
+        series = dcf.PriceSeries(payloads[ticker]["historicalPrice"]["historical"])
+        series.nearest(prepared[ticker][0]["date"])
+
+def stage_projected_metrics(tickers, payloads, prepared):
+    for ticker in tickers:
+        metrics, prevMetrics = prepared[ticker]
+        dcf.projected_metrics(metrics, prevMetrics)
+
+def stage_future_discounted_free_cash_flow(tickers, payloads, prepared):
+    for ticker in tickers:
+        metrics, prevMetrics = prepared[ticker]
+        dcf.future_discounted_free_cash_flow(metrics, dcf.projected_metrics(metrics, prevMetrics))
+
+def stage_computations(tickers, payloads, prepared):
+    for ticker in tickers:
+        metrics, prevMetrics = prepared[ticker]
+        dcf.computations(metrics, prevMetrics)
+
+def stage_batch_computations(tickers, payloads, prepared):
+    metrics = dcf.stack_metrics([prepared[ticker][0] for ticker in tickers])
+    prevMetrics = dcf.stack_metrics([prepared[ticker][1] for ticker in tickers], dcf.BATCH_PREVIOUS_METRICS)
+    dcf.batch_computations(metrics, prevMetrics)
+
+# The whole valuation of every ticker, from the cached responses to the DCF value
+def stage_pipeline(tickers, payloads, prepared):
+    dcf.priceStore.clear()
+    for ticker in tickers:
+        dcf.value_ticker(ticker)
+
+STAGES = {
+    "isolate_data": stage_isolate_data,
+    "share_price": stage_share_price,
+    "projected_metrics": stage_projected_metrics,
+    "future_discounted_free_cash_flow": stage_future_discounted_free_cash_flow,
+    "computations": stage_computations,
+    "batch_computations": stage_batch_computations,
+    "pipeline": stage_pipeline,
+}
+
+# Extracts the metrics of every ticker once, so the later stages can be timed on their own
+def prepare(tickers, payloads):
+    prepared = {}
+    for ticker in tickers:
+        session = preloaded_session(ticker, payloads[ticker])
+        metrics = dcf.isolate_data(dcf.pull_data(ticker, session))
+        prevMetrics = dcf.isolate_data_prev_year(dcf.pull_data_prev_year(ticker, session))
+        match = dcf.PriceSeries(payloads[ticker]["historicalPrice"]["historical"]).nearest(metrics["date"])
+        metrics["marketCap"] = match[1] * metrics["outstandingShares"]
+        prepared[ticker] = (metrics, prevMetrics)
+    return prepared
+
+# Runs one stage and returns its best time over the repeats and its peak traced memory.
+# Memory is measured on a separate run as tracing slows everything down
+def measure(stage, tickers, payloads, prepared, repeat, traceMemory):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage(tickers, payloads, prepared)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if traceMemory:
+        tracemalloc.start()
+        stage(tickers, payloads, prepared)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+# Imports the module in fresh interpreters and returns the fastest import time along with
+# any of LAZY_MODULES that got imported with it
+def measure_import(repeat):
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import DiscountedCashFlow\n"
+        "seconds = time.perf_counter() - start\n"
+        "print(json.dumps({'seconds': seconds, 'modules': [name for name in %r if name in sys.modules]}))\n" % (LAZY_MODULES,)
+    )
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(dcf.__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output)
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return {"seconds": best["seconds"], "lazyModulesImported": best["modules"]}
+
+def run(sizes, stages, repeat, traceMemory, seed):
+    results = {}
+    with tempfile.TemporaryDirectory() as cacheDirectory:
+        settings = (dcf.CACHE_DIRECTORY, dcf.CACHE_ENABLED, dcf.OFFLINE_MODE, dcf.CACHE_MAX_BYTES)
+        dcf.CACHE_DIRECTORY, dcf.CACHE_ENABLED, dcf.OFFLINE_MODE = cacheDirectory, True, False
+        dcf.CACHE_MAX_BYTES = 1 << 40
+        try:
+            for size in sizes:
+                tickers = ticker_names(size)
+                payloads = {ticker: synthetic_payloads(ticker, seed) for ticker in tickers}
+                if "pipeline" in stages:
+                    dcf.clear_cache()
+                    fill_cache(payloads)
+                dcf.OFFLINE_MODE = True
+                prepared = prepare(tickers, payloads)
+
+                results[str(size)] = {}
+                # share_price prints every price it finds
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for name in stages:
+                        elapsed, peak = measure(STAGES[name], tickers, payloads, prepared, repeat, traceMemory)
+                        results[str(size)][name] = {
+                            "seconds": elapsed,
+                            "tickersPerSecond": size / elapsed if elapsed else float("inf"),
+                            "peakMemoryBytes": peak,
+                        }
+                dcf.OFFLINE_MODE = False
+        finally:
+            dcf.CACHE_DIRECTORY, dcf.CACHE_ENABLED, dcf.OFFLINE_MODE, dcf.CACHE_MAX_BYTES = settings
+    return results
+
+# Compares throughput with the baseline and returns the stages that got slower than their
+# threshold allows, as (size, stage, baseline, current)
+def regressions(results, baseline, thresholds, defaultThreshold):
+    slower = []
+    if "import" in results:
+        current = results["import"]
+        for name in current["lazyModulesImported"]:
+            slower.append(("-", "import", name + " not imported", name + " imported"))
+        reference = baseline.get("import")
+        if reference is not None and current["seconds"] > reference["seconds"] * (1 + thresholds.get("import", defaultThreshold)):
+            slower.append(("-", "import", "%.3fs" % reference["seconds"], "%.3fs" % current["seconds"]))
+
+    for size, stages in results.items():
+        if size == "import":
+            continue
+        for name, result in stages.items():
+            reference = baseline.get(size, {}).get(name)
+            if reference is None:
+                continue
+            threshold = thresholds.get(name, defaultThreshold)
+            if result["tickersPerSecond"] < reference["tickersPerSecond"] * (1 - threshold):
+                slower.append((size, name, "%.0f tickers/s" % reference["tickersPerSecond"], "%.0f tickers/s" % result["tickersPerSecond"]))
+    return slower
+
+def report(results, baseline):
+    print("%-8s %-34s %12s %14s %12s %10s" % ("tickers", "stage", "seconds", "tickers/s", "peak MiB", "vs base"))
+    for size, stages in results.items():
+        if size == "import":
+            continue
+        for name, result in stages.items():
+            reference = baseline.get(size, {}).get(name)
+            change = "%+.0f%%" % ((result["tickersPerSecond"] / reference["tickersPerSecond"] - 1) * 100) if reference else "-"
+            peak = "%.1f" % (result["peakMemoryBytes"] / 2 ** 20) if result["peakMemoryBytes"] is not None else "-"
+            print("%-8s %-34s %12.4f %14.0f %12s %10s" % (size, name, result["seconds"], result["tickersPerSecond"], peak, change))
+    if "import" in results:
+        result = results["import"]
+        reference = baseline.get("import")
+        change = "%+.0f%%" % ((result["seconds"] / reference["seconds"] - 1) * 100) if reference else "-"
+        print("%-8s %-34s %12.4f %14s %12s %10s" % ("-", "import", result["seconds"], "-", "-", change))
+        if result["lazyModulesImported"]:
+            print("Imported on startup:", ", ".join(result["lazyModulesImported"]))
+
+def parse_thresholds(values):
+    thresholds = {}
+    default = DEFAULT_THRESHOLD
+    for value in values:
+        if "=" in value:
+            name, fraction = value.split("=", 1)
+            thresholds[name] = float(fraction)
+        else:
+            default = float(value)
+    return thresholds, default
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DCF hot paths on synthetic data, fully offline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="numbers of tickers to benchmark")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best one is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory runs")
+    parser.add_argument("--import-repeat", type=int, default=5, help="fresh interpreters used to time the import, 0 to skip")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", action="append", default=[],
+                        help="allowed throughput drop, either for every stage (0.2) or for one (pipeline=0.5)")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    arguments = parser.parse_args(arguments)
+
+    results = run(arguments.sizes, arguments.stages, arguments.repeat, not arguments.no_memory, arguments.seed)
+    if arguments.import_repeat:
+        results["import"] = measure_import(arguments.import_repeat)
+
+    baseline = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)
+    report(results, baseline)
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if arguments.save_baseline:
+        with open(arguments.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print("Saved baseline to", arguments.baseline)
+        return 0
+
+    thresholds, defaultThreshold = parse_thresholds(arguments.threshold)
+    slower = regressions(results, baseline, thresholds, defaultThreshold)
+    for size, name, reference, current in slower:
+        print("Regression: %s with %s tickers went from %s to %s" % (name, size, reference, current))
+    return 1 if slower else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
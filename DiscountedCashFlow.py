@@ -21,9 +21,24 @@ the use of the initial DCF model and other metrics.
 
 # Imports
 import json
-from urllib.request import urlopen
-import pandas as pd
-import matplotlib.pyplot as plt
+import bisect
+import contextlib
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import itertools
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+from urllib.parse import urlsplit, parse_qsl, urlencode
+import numpy as np
 import math
 
 # This is a constant metric calculated by subtracting the return rate of AA bonds by the inflation rate
@@ -36,215 +51,605 @@ EXPECTED_RETURN_OF_THE_MARKET_PER_ANNUM = 0.064
 # Source: U.S. Department of the Treasury
 AA_BOND_EFFECTIVE_YIELD = 0.0175
 
-# Call API and concatenate JSON files for current year data
-def pull_data(ticker):
+# Share of the enterprise value that is kept, to account for overestimation as many
+# companies had very profitable years during covid
+ENTERPRISE_VALUE_HAIRCUT = 0.7
+
+# Number of years explicitly forecast. None keeps the original model, which projects a
+# single year and discounts it once. With a horizon, a terminal value of "gordon" (growing
+# perpetuity) or "exit" (EBITDA multiple) is added after the last forecast year
+FORECAST_YEARS = None
+TERMINAL_VALUE = "gordon"
+TERMINAL_GROWTH_RATE = 0.02
+EXIT_MULTIPLE = 10.0
+
+# Monte Carlo valuation settings. Draws are evaluated chunkSize at a time so the
+# intermediate arrays stay the same size however many draws are asked for
+MONTE_CARLO_DRAWS = 1000000
+MONTE_CARLO_CHUNK_SIZE = 100000
+MONTE_CARLO_PERCENTILES = (5, 25, 50, 75, 95)
+
+# Distribution every simulated assumption is drawn from: ("normal", mean, standard deviation),
+# ("uniform", low, high), ("triangular", low, mode, high) or ("fixed", value). A mean or
+# mode of None centers the distribution on the company's own point estimate
+MONTE_CARLO_DISTRIBUTIONS = {
+    "averageBeta": ("normal", None, 0.2),
+    "marketPremium": ("normal", None, 0.01),
+    "AABondEffectiveYield": ("normal", None, 0.0025),
+    "ebitdaGrowth": ("normal", None, 0.05),
+}
+
+# Assumptions that look like they could be simulated but never reach DCFValuePerShare, with
+# the reason. Revenue only feeds investedCapitalOverRevenue; the cash flows are projected
+# from EBITDA, taxes and working capital
+NO_EFFECT_ASSUMPTIONS = {
+    "revenueGrowth": "revenue doesn't enter the projected cash flows, use ebitdaGrowth instead",
+}
+
+# Responses from Financial Modeling Prep are cached on disk so fundamentals, which only
+# change once per filing, aren't downloaded again on every run. Entries are gzipped and the
+# least recently used ones are evicted once the cache grows past CACHE_MAX_BYTES
+CACHE_ENABLED = True
+CACHE_DIRECTORY = os.environ.get("DCF_CACHE_DIR", ".fmp_cache")
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# When offline, every request is answered from the cache (expired entries included) and a
+# request that was never cached raises a CacheMissError instead of touching the network
+OFFLINE_MODE = os.environ.get("DCF_OFFLINE") == "1"
+
+# How long a cached response stays fresh, by endpoint. Prices move daily while statements
+# only change when a new filing comes out
+CACHE_TTL_SECONDS = {
+    "historical-price-full": 6 * 60 * 60,
+    "profile": 24 * 60 * 60,
+    "shares_float": 24 * 60 * 60,
+    "nasdaq_constituent": 24 * 60 * 60,
+    "stock": 24 * 60 * 60,
+    "enterprise-values": 7 * 24 * 60 * 60,
+    "balance-sheet-statement": 30 * 24 * 60 * 60,
+    "balance-sheet-statement-as-reported": 30 * 24 * 60 * 60,
+    "income-statement": 30 * 24 * 60 * 60,
+}
+DEFAULT_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+# Number of tickers screened at the same time. Each worker thread keeps its own
+# keep-alive connection to the API, so this is also the number of open connections
+SCREEN_CONCURRENCY = 8
+HTTP_TIMEOUT_SECONDS = 30
+
+# Where requests to financialmodelingprep.com are sent, e.g. http://127.0.0.1:8100 to use
+# MockFMPServer.py instead of the real API
+API_BASE_URL = os.environ.get("DCF_API_BASE", "https://financialmodelingprep.com")
+
+# Requests the API plan allows per minute and how many may go out at once after a quiet
+# spell. None turns the rate limit off
+RATE_LIMIT_PER_MINUTE = 300
+RATE_LIMIT_BURST = 10
+
+# Throttled (429) and server error (5xx) responses are retried this many times, waiting
+# RETRY_BACKOFF_SECONDS * 2 ** attempt, or as long as the API asks, in between
+RETRY_ATTEMPTS = 4
+RETRY_BACKOFF_SECONDS = 1.0
+
+# Symbols asked for in one request on the endpoints that accept a comma separated list
+PROFILE_BATCH_SIZE = 50
+PRICE_BATCH_SIZE = 5
+
+# Screening writes a row per ticker to SCREEN_OUTPUT_PATH (.jsonl or .csv) as soon as it is
+# valued, and only keeps the SCREEN_TOP_K most undervalued and most overvalued companies for
+# the chart, ranked by "difference" (DCF price - share price) or "percentDifference"
+SCREEN_OUTPUT_PATH = "screen_results.jsonl"
+SCREEN_CHART_PATH = "screen_top.png"
+SCREEN_TOP_K = 20
+SCREEN_RANK_BY = "difference"
+
+# Number of tickers whose price history is kept in memory, and how many days away from a
+# filing date the closest trading day may be
+PRICE_STORE_SIZE = 512
+PRICE_LOOKUP_WINDOW_DAYS = 10
+
+# Instrumentation records how long every stage takes, the latency and size of every API
+# response, cache hits and failures by ticker. It costs a single flag check per call while
+# turned off, and when turned on the results are written out at the end of a run
+INSTRUMENTATION_ENABLED = os.environ.get("DCF_INSTRUMENT") == "1"
+INSTRUMENTATION_JSON_PATH = "dcf_metrics.json"
+INSTRUMENTATION_PROMETHEUS_PATH = "dcf_metrics.prom"
+
+# Upper bounds, in seconds, of the wall time histogram buckets
+HISTOGRAM_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+# Where the local fundamentals store lives (see FundamentalsStore). With SCREEN_FROM_STORE
+# the screen values every stored ticker from it instead of downloading the NASDAQ 100
+STORE_DIRECTORY = os.environ.get("DCF_STORE_DIR", "fundamentals_store")
+SCREEN_FROM_STORE = os.environ.get("DCF_SCREEN_FROM_STORE") == "1"
+
+# Financial Modeling Prep endpoints used for a ticker. The statement endpoints are
+# shared by the current and previous year pulls so they only need to be downloaded once
+ENDPOINT_URLS = {
+    "balanceSheet": "https://financialmodelingprep.com/api/v3/balance-sheet-statement/{ticker}?limit=120&apikey=<API_KEY>",
+    "outstandingShares": "https://financialmodelingprep.com/api/v4/shares_float?symbol={ticker}&apikey=<API_KEY>",
+    "enterpriseValue": "https://financialmodelingprep.com/api/v3/enterprise-values/{ticker}?limit=40&apikey=<API_KEY>",
+    "incomeStatement": "https://financialmodelingprep.com/api/v3/income-statement/{ticker}?limit=120&apikey=<API_KEY>",
+    "profile": "https://financialmodelingprep.com/api/v3/profile/{ticker}?apikey=<API_KEY>",
+    "reportedBS": "https://financialmodelingprep.com/api/v3/balance-sheet-statement-as-reported/{ticker}?limit=10&apikey=<API_KEY>",
+    "historicalPrice": "https://financialmodelingprep.com/api/v3/historical-price-full/{ticker}?serietype=line&apikey=<API_KEY>",
+}
+
+# Counts how many observations fell into each bucket of HISTOGRAM_BUCKETS
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.counts = [count + otherCount for count, otherCount in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def to_dict(self):
+        buckets = {str(bound): count for bound, count in zip(HISTOGRAM_BUCKETS + ("+Inf",), self.counts)}
+        return {"count": self.count, "sum": self.sum, "max": self.max, "buckets": buckets}
+
+class Instrumentation:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.requests = {}
+        self.responseBytes = {}
+        self.cache = {"hit": 0, "miss": 0}
+        self.failures = {}
+        self.retries = {}
+
+    # Hands over everything counted so far and starts again from zero. The result can be
+    # pickled, so worker processes send it back to be merged into the parent's counts
+    def drain(self):
+        with self.lock:
+            state = {"stages": self.stages, "requests": self.requests, "responseBytes": self.responseBytes,
+                     "cache": self.cache, "failures": self.failures, "retries": self.retries}
+            self.reset()
+        return state
+
+    def merge(self, state):
+        with self.lock:
+            for name in ("stages", "requests"):
+                histograms = getattr(self, name)
+                for key, histogram in state[name].items():
+                    histograms.setdefault(key, Histogram()).merge(histogram)
+            for name in ("responseBytes", "cache", "failures", "retries"):
+                counts = getattr(self, name)
+                for key, count in state[name].items():
+                    counts[key] = counts.get(key, 0) + count
+
+    def observe_stage(self, stage, seconds):
+        with self.lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+
+    def observe_request(self, endpoint, seconds, size):
+        with self.lock:
+            self.requests.setdefault(endpoint, Histogram()).observe(seconds)
+            self.responseBytes[endpoint] = self.responseBytes.get(endpoint, 0) + size
+
+    def count_cache(self, hit):
+        with self.lock:
+            self.cache["hit" if hit else "miss"] += 1
+
+    def count_retry(self, endpoint, reason):
+        key = (endpoint, str(reason))
+        with self.lock:
+            self.retries[key] = self.retries.get(key, 0) + 1
+
+    def count_failure(self, ticker, error):
+        key = (type(error).__name__, ticker)
+        with self.lock:
+            self.failures[key] = self.failures.get(key, 0) + 1
+
+    def to_dict(self):
+        with self.lock:
+            lookups = self.cache["hit"] + self.cache["miss"]
+            return {
+                "stages": {stage: histogram.to_dict() for stage, histogram in self.stages.items()},
+                "requests": {
+                    endpoint: dict(histogram.to_dict(), bytes=self.responseBytes[endpoint],
+                                   averageBytes=self.responseBytes[endpoint] / histogram.count)
+                    for endpoint, histogram in self.requests.items()
+                },
+                "cache": dict(self.cache, hitRate=self.cache["hit"] / lookups if lookups else None),
+                "failures": [{"exception": exception, "ticker": ticker, "count": count} for (exception, ticker), count in sorted(self.failures.items())],
+                "retries": [{"endpoint": endpoint, "reason": reason, "count": count} for (endpoint, reason), count in sorted(self.retries.items())],
+            }
+
+    # The same numbers in the Prometheus text exposition format
+    def to_prometheus(self):
+        def label(value):
+            return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+        def histogram_lines(name, labelName, histograms):
+            lines = []
+            for key, histogram in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(HISTOGRAM_BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{%s="%s",le="%s"} %d' % (name, labelName, label(key), bound, cumulative))
+                lines.append('%s_sum{%s="%s"} %r' % (name, labelName, label(key), histogram.sum))
+                lines.append('%s_count{%s="%s"} %d' % (name, labelName, label(key), histogram.count))
+            return lines
+
+        with self.lock:
+            lines = ["# HELP dcf_stage_seconds Wall time of each valuation stage", "# TYPE dcf_stage_seconds histogram"]
+            lines += histogram_lines("dcf_stage_seconds", "stage", self.stages)
+            lines += ["# HELP dcf_request_seconds Latency of Financial Modeling Prep requests", "# TYPE dcf_request_seconds histogram"]
+            lines += histogram_lines("dcf_request_seconds", "endpoint", self.requests)
+            lines += ["# HELP dcf_response_bytes_total Size of Financial Modeling Prep responses", "# TYPE dcf_response_bytes_total counter"]
+            lines += ['dcf_response_bytes_total{endpoint="%s"} %d' % (label(endpoint), size) for endpoint, size in sorted(self.responseBytes.items())]
+            lines += ["# HELP dcf_cache_lookups_total Response cache lookups", "# TYPE dcf_cache_lookups_total counter"]
+            lines += ['dcf_cache_lookups_total{result="%s"} %d' % (result, count) for result, count in sorted(self.cache.items())]
+            lines += ["# HELP dcf_failures_total Tickers that could not be valued", "# TYPE dcf_failures_total counter"]
+            lines += ['dcf_failures_total{exception="%s",ticker="%s"} %d' % (label(exception), label(ticker), count) for (exception, ticker), count in sorted(self.failures.items())]
+            lines += ["# HELP dcf_retries_total Requests retried after being throttled or failing", "# TYPE dcf_retries_total counter"]
+            lines += ['dcf_retries_total{endpoint="%s",reason="%s"} %d' % (label(endpoint), label(reason), count) for (endpoint, reason), count in sorted(self.retries.items())]
+        return "\n".join(lines) + "\n"
+
+    def export(self, jsonPath=INSTRUMENTATION_JSON_PATH, prometheusPath=INSTRUMENTATION_PROMETHEUS_PATH):
+        with open(jsonPath, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+        with open(prometheusPath, "w") as file:
+            file.write(self.to_prometheus())
+
+instrumentation = Instrumentation()
+
+# Times every call of the decorated function as the given stage while instrumentation is on
+def instrumented(stage):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not INSTRUMENTATION_ENABLED:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                instrumentation.observe_stage(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def record_failure(ticker, error):
+    if INSTRUMENTATION_ENABLED:
+        instrumentation.count_failure(ticker, error)
+
+# Holds the payloads downloaded for a single ticker. Each endpoint is fetched the first
+# time it is asked for and then reused, so pulling the current and previous year of the
+# same ticker costs one request per endpoint instead of two
+class FetchSession:
+    def __init__(self, ticker, limit=None):
+        self.ticker = ticker
+        # Caps how many periods the statement endpoints return, for when only the latest
+        # filings are needed
+        self.limit = limit
+        self.payloads = {}
+
+    def get(self, endpoint):
+        if endpoint not in self.payloads:
+            url = ENDPOINT_URLS[endpoint].format(ticker=self.ticker)
+            if self.limit is not None:
+                url = re.sub(r"limit=\d+", "limit=" + str(self.limit), url)
+            self.payloads[endpoint] = get_jsonparsed_data(url)
+        return self.payloads[endpoint]
+
+# Call API and collect the current year's record from each endpoint
+@instrumented("pull_data")
+def pull_data(ticker, session=None):
+    if session is None:
+        session = FetchSession(ticker)
+
     # Sourced from Financial Modeling Prep
-    balanceSheetUrl = "https://financialmodelingprep.com/api/v3/balance-sheet-statement/" + ticker + "?limit=120&apikey=<API_KEY>"
-    balanceSheet = get_jsonparsed_data(balanceSheetUrl)
-    outstandingSharesUrl = "https://financialmodelingprep.com/api/v4/shares_float?symbol=" + ticker + "&apikey=<API_KEY>"
-    outstandingShares = get_jsonparsed_data(outstandingSharesUrl)
-    enterpriseValueUrl = "https://financialmodelingprep.com/api/v3/enterprise-values/" + ticker + "?limit=40&apikey=<API_KEY>"
-    enterpriseValue = get_jsonparsed_data(enterpriseValueUrl)
-    incomeStatementURl = "https://financialmodelingprep.com/api/v3/income-statement/" + ticker + "?limit=120&apikey=<API_KEY>"
-    incomeStatement = get_jsonparsed_data(incomeStatementURl)
-    profileURL = "https://financialmodelingprep.com/api/v3/profile/" + ticker + "?apikey=<API_KEY>"
-    profile = get_jsonparsed_data(profileURL)
-    reportedBSURl = "https://financialmodelingprep.com/api/v3/balance-sheet-statement-as-reported/" + ticker + "?limit=10&apikey=<API_KEY>"
-    reportedBS = get_jsonparsed_data(reportedBSURl)
-
-    df1 = pd.DataFrame([balanceSheet[0]])
-    df2 = pd.DataFrame([outstandingShares[0]])
-    df3 = pd.DataFrame([enterpriseValue[0]])
-    df4 = pd.DataFrame([incomeStatement[0]])
-    df5 = pd.DataFrame([profile[0]])
-    df6 = pd.DataFrame([reportedBS[0]])
-    data = pd.concat([df1, df2, df3, df4, df5, df6])
-    data.reset_index(drop=True, inplace=True)
-
-    # Sourced from Stack Overflow
-    data.to_json(ticker + "Data.json")
-    dt = open(ticker + "Data.json")
-    return json.load(dt)
-
-# Call API and concatenate JSON files for last year's data
-def pull_data_prev_year(ticker):
+    data = {}
+    for endpoint in ("balanceSheet", "outstandingShares", "enterpriseValue", "incomeStatement", "profile", "reportedBS"):
+        data[endpoint] = session.get(endpoint)[0]
+    return data
+
+# Call API and collect last year's record from each statement endpoint. Passing the session
+# used for pull_data reuses the statements that were already downloaded
+@instrumented("pull_data_prev_year")
+def pull_data_prev_year(ticker, session=None):
+    if session is None:
+        session = FetchSession(ticker)
+
     # Sourced from Financial Modeling Prep
-    balanceSheetUrl = "https://financialmodelingprep.com/api/v3/balance-sheet-statement/" + ticker + "?limit=120&apikey=<API_KEY>"
-    balanceSheet = get_jsonparsed_data(balanceSheetUrl)
-    enterpriseValueUrl = "https://financialmodelingprep.com/api/v3/enterprise-values/" + ticker + "?limit=40&apikey=<API_KEY>"
-    enterpriseValue = get_jsonparsed_data(enterpriseValueUrl)
-    incomeStatementURl = "https://financialmodelingprep.com/api/v3/income-statement/" + ticker + "?limit=120&apikey=<API_KEY>"
-    incomeStatement = get_jsonparsed_data(incomeStatementURl)
-    reportedBSURl = "https://financialmodelingprep.com/api/v3/balance-sheet-statement-as-reported/" + ticker + "?limit=10&apikey=<API_KEY>"
-    reportedBS = get_jsonparsed_data(reportedBSURl)
-
-    df1 = pd.DataFrame([balanceSheet[1]])
-    df2 = pd.DataFrame([enterpriseValue[1]])
-    df3 = pd.DataFrame([incomeStatement[1]])
-    df4 = pd.DataFrame([reportedBS[1]])
-    data = pd.concat([df1, df2, df3, df4])
-    data.reset_index(drop=True, inplace=True)
-
-    # Sourced from Stack Overflow
-    data.to_json(ticker + "Data(YearPrev).json")
-    dt = open(ticker + "Data(YearPrev).json")
-    return json.load(dt)
-
-# Isolate the data from the combined JSON file created in the pull_data method
-def isolate_data(data):
+    prevData = {}
+    for endpoint in ("balanceSheet", "enterpriseValue", "incomeStatement", "reportedBS"):
+        prevData[endpoint] = session.get(endpoint)[1]
+    return prevData
+
+# Marks a field that a valuation can't be done without
+REQUIRED = object()
+
+# Where every metric comes from: (metric name, field in the API record, endpoints to look in
+# by order of preference, default). A default of None leaves the metric out when the API
+# doesn't report it
+CURRENT_YEAR_FIELDS = (
+    ("date", "date", ("reportedBS", "incomeStatement", "balanceSheet"), REQUIRED),
+    ("ebitda", "ebitda", ("incomeStatement",), REQUIRED),
+    ("operatingExpenses", "operatingExpenses", ("incomeStatement",), None),
+    ("revenue", "revenue", ("incomeStatement",), REQUIRED),
+    ("enterpriseValue", "enterpriseValue", ("enterpriseValue",), None),
+    ("outstandingShares", "outstandingShares", ("outstandingShares",), REQUIRED),
+    ("incomeTaxExpense", "incomeTaxExpense", ("incomeStatement",), REQUIRED),
+    ("totalCurrentAssets", "totalCurrentAssets", ("balanceSheet",), REQUIRED),
+    ("totalCurrentLiabilities", "totalCurrentLiabilities", ("balanceSheet",), REQUIRED),
+    ("averageBeta", "beta", ("profile",), REQUIRED),
+    ("longTermDebt", "longTermDebt", ("balanceSheet",), REQUIRED),
+    ("cashAndCashEquivalents", "cashAndCashEquivalents", ("balanceSheet",), REQUIRED),
+    ("otherNonCurrentAssets", "otherNonCurrentAssets", ("balanceSheet",), REQUIRED),
+    ("otherCurrentAssets", "otherCurrentAssets", ("balanceSheet",), REQUIRED),
+    # Commercial paper is only listed by companies that issue it
+    ("commercialPaper", "commercialpaper", ("reportedBS",), 0),
+    ("netDebt", "netDebt", ("balanceSheet",), REQUIRED),
+)
+
+# The previous year is only used for growth rates and the change in invested capital
+PREVIOUS_YEAR_FIELDS = (
+    ("totalCurrentAssets", "totalCurrentAssets", ("balanceSheet",), REQUIRED),
+    ("revenue", "revenue", ("incomeStatement",), REQUIRED),
+    ("totalCurrentLiabilities", "totalCurrentLiabilities", ("balanceSheet",), REQUIRED),
+    ("ebitda", "ebitda", ("incomeStatement",), REQUIRED),
+    ("operatingExpenses", "operatingExpenses", ("incomeStatement",), None),
+    ("enterpriseValue", "enterpriseValue", ("enterpriseValue",), None),
+    ("incomeTaxExpense", "incomeTaxExpense", ("incomeStatement",), REQUIRED),
+    ("longTermDebt", "longTermDebt", ("balanceSheet",), REQUIRED),
+    ("commercialPaper", "commercialpaper", ("reportedBS",), None),
+)
+
+# Raised when the API didn't report fields the valuation needs. It is a KeyError so
+# callers that already skip tickers on a KeyError keep doing so
+class MissingFieldsError(KeyError):
+    def __init__(self, missing):
+        self.missing = missing
+        super().__init__(missing)
+
+    def __str__(self):
+        return "Missing fields: " + ", ".join(metric + " (" + "/".join(sources) + "." + field + ")" for metric, field, sources in self.missing)
+
+# Pulls every metric in the field table out of the endpoint records. All the missing
+# required fields are reported together rather than failing on the first one, or, when
+# strict is False, simply left out
+def extract_metrics(records, fields, strict=True):
     metrics = {}
+    missing = []
+    for metric, field, sources, default in fields:
+        value = None
+        for source in sources:
+            record = records.get(source)
+            if record is not None:
+                value = record.get(field)
+                if value is not None:
+                    break
+        if value is not None:
+            metrics[metric] = value
+        elif default is REQUIRED:
+            missing.append((metric, field, sources))
+        elif default is not None:
+            metrics[metric] = default
+    if missing and strict:
+        raise MissingFieldsError(missing)
+    return metrics
 
-    # Altenative way to do this: Create a dictionary and iterate through that to find the
-    # needed values. Would be a long dictionary though.
-
-    # For current year
-    for key, value in data.items():
-        if key == "date":
-            for key, value in value.items():
-                if value != None:
-                    metrics["date"] = value
-        elif key == "ebitda":
-            for key, value in value.items():
-                if value != None:
-                    metrics["ebitda"] = value
-        elif key == "operatingExpenses":
-            for key, value in value.items():
-                if value != None:
-                    metrics["operatingExpenses"] = value
-        elif key == "revenue":
-            for key, value in value.items():
-                if value != None:
-                    metrics["revenue"] = value
-        elif key == "enterpriseValue":
-            for key, value in value.items():
-                if value != None:
-                    metrics["enterpriseValue"] = value
-        elif key == "outstandingShares":
-            for key, value in value.items():
-                if value != None:
-                    metrics["outstandingShares"] = value
-        elif key == "incomeTaxExpense":
-            for key, value in value.items():
-                if value != None:
-                    metrics["incomeTaxExpense"] = value
-        elif key == "totalCurrentAssets":
-            for key, value in value.items():
-                if value != None:
-                    metrics["totalCurrentAssets"] = value
-        elif key == "totalCurrentLiabilities":
-            for key, value in value.items():
-                if value != None:
-                    metrics["totalCurrentLiabilities"] = value
-        elif key == "beta":
-            for key, value in value.items():
-                if value != None:
-                    metrics["averageBeta"] = value
-        elif key == "longTermDebt":
-            for key, value in value.items():
-                if value != None:
-                    metrics["longTermDebt"] = value
-        elif key == "cashAndCashEquivalents":
-            for key, value in value.items():
-                if value != None:
-                    metrics["cashAndCashEquivalents"] = value
-        elif key == "otherNonCurrentAssets":
-            for key, value in value.items():
-                if value != None:
-                    metrics["otherNonCurrentAssets"] = value
-        elif key == "otherCurrentAssets":
-            for key, value in value.items():
-                if value != None:
-                    metrics["otherCurrentAssets"] = value
-        elif key == "commercialpaper":
-            for key, value in value.items():
-                if value != None:
-                    metrics["commercialPaper"] = value
-        elif key == "netDebt":
-            for key, value in value.items():
-                if value != None:
-                    metrics["netDebt"] = value
-        else:
-            metrics["commercialPaper"] = 0
-
-    # This is a constant metric calculated by subtracting the return rate of AA bonds by the inflation rate
-    # Source: U.S. Department of the Treasury
-    metrics["riskFreeRatePerAnnum"] = RISK_FREE_RATE_PER_ANNUM
+# Every metric a metrics record can hold, in a fixed order: the date, everything in the
+# field tables and the market cap worked out from the share price
+METRIC_FIELDS = tuple(dict.fromkeys(metric for metric, _, _, _ in CURRENT_YEAR_FIELDS + PREVIOUS_YEAR_FIELDS)) + ("marketCap",)
+METRIC_INDEX = {name: index for index, name in enumerate(METRIC_FIELDS)}
+MACRO_ASSUMPTION_NAMES = ("riskFreeRatePerAnnum", "expectedReturnOfTheMarketPerAnnum", "AABondEffectiveYield")
 
-    # Source: U.S. Department of the Treasury
-    metrics["expectedReturnOfTheMarketPerAnnum"] = EXPECTED_RETURN_OF_THE_MARKET_PER_ANNUM
+# The macro assumptions shared by every company. Records point to one of these rather than
+# each holding a copy, so changing an assumption on a record replaces its object instead of
+# editing the shared one
+class MacroAssumptions:
+    __slots__ = MACRO_ASSUMPTION_NAMES
 
-    # Source: U.S. Department of the Treasury
-    metrics["AABondEffectiveYield"] = AA_BOND_EFFECTIVE_YIELD
+    def __init__(self, riskFreeRatePerAnnum, expectedReturnOfTheMarketPerAnnum, AABondEffectiveYield):
+        self.riskFreeRatePerAnnum = riskFreeRatePerAnnum
+        self.expectedReturnOfTheMarketPerAnnum = expectedReturnOfTheMarketPerAnnum
+        self.AABondEffectiveYield = AABondEffectiveYield
 
-    return metrics
+    def values(self):
+        return (self.riskFreeRatePerAnnum, self.expectedReturnOfTheMarketPerAnnum, self.AABondEffectiveYield)
 
-# Isolate the data from the combined JSON file created in the pull_data_prev_year method
-def isolate_data_prev_year(prevData):
-    prevMetrics = {}
-
-    # For year previous
-    for key, value in prevData.items():
-        if key == "totalCurrentAssets":
-            for key, value in value.items():
-                if value != None:
-                    prevMetrics["totalCurrentAssets"] = value
-        elif key == "revenue":
-            for key, value in value.items():
-                if value != None:
-                    prevMetrics["revenue"] = value
-        elif key == "totalCurrentLiabilities":
-            for key, value in value.items():
-                if value != None:
-                    prevMetrics["totalCurrentLiabilities"] = value
-        elif key == "ebitda":
-            for key, value in value.items():
-                if value != None:
-                    prevMetrics["ebitda"] = value
-        elif key == "operatingExpenses":
-            for key, value in value.items():
-                if value != None:
-                    prevMetrics["operatingExpenses"] = value
-        elif key == "enterpriseValue":
-            for key, value in value.items():
-                if value != None:
-                    prevMetrics["enterpriseValue"] = value
-        elif key == "outstandingShares":
-            for key, value in value.items():
-                if value != None:
-                    prevMetrics["outstandingShares"] = value
-        elif key == "incomeTaxExpense":
-            for key, value in value.items():
-                if value != None:
-                    prevMetrics["incomeTaxExpense"] = value
-        elif key == "beta":
-            for key, value in value.items():
-                if value != None:
-                    prevMetrics["averageBeta"] = value
-        elif key == "longTermDebt":
-            for key, value in value.items():
-                if value != None:
-                    prevMetrics["longTermDebt"] = value
-        elif key == "commercialpaper":
-            for key, value in value.items():
-                if value != None:
-                    prevMetrics["commercialPaper"] = value
+    def replace(self, name, value):
+        values = dict(zip(MACRO_ASSUMPTION_NAMES, self.values()))
+        values[name] = value
+        return MacroAssumptions(**values)
 
+    def __eq__(self, other):
+        return isinstance(other, MacroAssumptions) and self.values() == other.values()
 
-    # This is a constant metric calculated by subtracting the return rate of AA bonds by the inflation rate
-    # Source: U.S. Department of the Treasury
-    prevMetrics["riskFreeRatePerAnnum"] = RISK_FREE_RATE_PER_ANNUM
+    def __hash__(self):
+        return hash(self.values())
 
-    # Source: U.S. Department of the Treasury
-    prevMetrics["expectedReturnOfTheMarketPerAnnum"] = EXPECTED_RETURN_OF_THE_MARKET_PER_ANNUM
+macroState = {"assumptions": None}
 
+# The assumptions from the constants at the top of the file, one object for every record
+# as long as the constants don't change
+def shared_macro_assumptions():
+    # This is a constant metric calculated by subtracting the return rate of AA bonds by the inflation rate
     # Source: U.S. Department of the Treasury
-    prevMetrics["AABondEffectiveYield"] = AA_BOND_EFFECTIVE_YIELD
+    values = (RISK_FREE_RATE_PER_ANNUM, EXPECTED_RETURN_OF_THE_MARKET_PER_ANNUM, AA_BOND_EFFECTIVE_YIELD)
+    if macroState["assumptions"] is None or macroState["assumptions"].values() != values:
+        macroState["assumptions"] = MacroAssumptions(*values)
+    return macroState["assumptions"]
+
+# The metrics of one company for one year. It reads like a dict, but only holds the metrics
+# in METRIC_FIELDS, one slot each, and a metric the API didn't report is simply not set
+# (see missing) rather than stored as None. The macro assumptions are read through a
+# shared MacroAssumptions object
+class MetricsRecord(MutableMapping):
+    __slots__ = METRIC_FIELDS + ("assumptions",)
+
+    # Another record is copied slot by slot and keeps sharing its assumptions, unless others
+    # are given
+    def __init__(self, values=(), assumptions=None):
+        if isinstance(values, MetricsRecord):
+            if assumptions is None:
+                assumptions = values.assumptions
+            values = [(name, getattr(values, name)) for name in METRIC_FIELDS if hasattr(values, name)]
+        elif isinstance(values, Mapping):
+            values = values.items()
+        self.assumptions = assumptions
+        for name, value in values:
+            self[name] = value
+
+    def __getitem__(self, name):
+        if name in METRIC_INDEX:
+            try:
+                return getattr(self, name)
+            except AttributeError:
+                raise KeyError(name) from None
+        if name in MACRO_ASSUMPTION_NAMES and self.assumptions is not None:
+            return getattr(self.assumptions, name)
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        if name in METRIC_INDEX:
+            return hasattr(self, name)
+        return name in MACRO_ASSUMPTION_NAMES and self.assumptions is not None
+
+    def __setitem__(self, name, value):
+        if name in METRIC_INDEX:
+            setattr(self, name, value)
+        elif name in MACRO_ASSUMPTION_NAMES:
+            if self.assumptions is None:
+                self.assumptions = shared_macro_assumptions()
+            self.assumptions = self.assumptions.replace(name, value)
+        else:
+            raise KeyError(name + " is not a metric")
+
+    def __delitem__(self, name):
+        if name not in METRIC_INDEX or not hasattr(self, name):
+            raise KeyError(name)
+        delattr(self, name)
+
+    def __iter__(self):
+        for name in METRIC_FIELDS:
+            if hasattr(self, name):
+                yield name
+        if self.assumptions is not None:
+            yield from MACRO_ASSUMPTION_NAMES
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "MetricsRecord(" + repr(dict(self)) + ")"
+
+    # Metrics of the schema this record doesn't have
+    @property
+    def missing(self):
+        return tuple(name for name in METRIC_FIELDS if not hasattr(self, name))
+
+    def copy(self):
+        return MetricsRecord(self)
+
+    # A plain dict of the metrics and the assumptions, for code that looks them up one at a
+    # time, where going through __getitem__ costs more than the arithmetic
+    def as_dict(self):
+        values = {name: getattr(self, name) for name in METRIC_FIELDS if hasattr(self, name)}
+        if self.assumptions is not None:
+            values.update(zip(MACRO_ASSUMPTION_NAMES, self.assumptions.values()))
+        return values
+
+# Layout of a MetricsTable row. Missing values are NaN (NaT for the date) and flagged in the
+# missing mask, so a real NaN can still be told apart from a metric that wasn't reported
+METRICS_DTYPE = np.dtype(
+    [("date", "datetime64[D]")] + [(name, np.float64) for name in METRIC_FIELDS[1:]]
+    + [("missing", np.bool_, (len(METRIC_FIELDS),))]
+)
+
+# Many metrics records in one NumPy structured array, a row per company and year, with every
+# value stored unboxed in 8 bytes rather than as a Python object. Columns are views of the array, so
+# a table can be handed to batch_computations as it is, and an existing array of
+# METRICS_DTYPE, e.g. one loaded with np.load(mmap_mode="r"), is wrapped without a copy
+class MetricsTable:
+    def __init__(self, array, assumptions=None):
+        if array.dtype != METRICS_DTYPE:
+            raise ValueError("Expected an array of METRICS_DTYPE")
+        self.array = array
+        self.assumptions = shared_macro_assumptions() if assumptions is None else assumptions
+
+    @classmethod
+    def from_records(cls, records):
+        records = list(records)
+        assumptions = {record.assumptions for record in records if record.assumptions is not None}
+        if len(assumptions) > 1:
+            raise ValueError("The records don't share the same macro assumptions")
+        array = np.zeros(len(records), dtype=METRICS_DTYPE)
+        for index, name in enumerate(METRIC_FIELDS):
+            values = [getattr(record, name, None) for record in records]
+            missing = np.array([value is None for value in values], dtype=np.bool_)
+            if name == "date":
+                array[name] = np.array(["NaT" if value is None else value[:10] for value in values], dtype="datetime64[D]")
+            else:
+                array[name] = np.array([math.nan if value is None else value for value in values], dtype=np.float64)
+            array["missing"][:, index] = missing
+        return cls(array, assumptions.pop() if assumptions else None)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __contains__(self, name):
+        return name in METRIC_INDEX or name in MACRO_ASSUMPTION_NAMES
+
+    # The column of a metric as a view of the table, or a macro assumption as one number
+    def __getitem__(self, name):
+        if name in METRIC_INDEX:
+            return self.array[name]
+        if name in MACRO_ASSUMPTION_NAMES:
+            return getattr(self.assumptions, name)
+        raise KeyError(name)
+
+    def missing(self, name):
+        return self.array["missing"][:, METRIC_INDEX[name]]
+
+    def record(self, index):
+        row = self.array[index]
+        missing = row["missing"]
+        record = MetricsRecord(assumptions=self.assumptions)
+        for position, name in enumerate(METRIC_FIELDS):
+            if not missing[position]:
+                setattr(record, name, str(row[name]) if name == "date" else float(row[name]))
+        return record
+
+    def records(self):
+        return [self.record(index) for index in range(len(self.array))]
+
+# Isolate the current year's metrics from the records collected in the pull_data method
+@instrumented("isolate_data")
+def isolate_data(data):
+    return MetricsRecord(extract_metrics(data, CURRENT_YEAR_FIELDS), shared_macro_assumptions())
 
-    return prevMetrics
+# Isolate last year's metrics from the records collected in the pull_data_prev_year method
+@instrumented("isolate_data_prev_year")
+def isolate_data_prev_year(prevData):
+    return MetricsRecord(extract_metrics(prevData, PREVIOUS_YEAR_FIELDS), shared_macro_assumptions())
 
-# Method where all of my computations are done using the data extracted from the above methods
-def computations(metrics, prevMetrics):
+# Method where all of my computations are done using the data extracted from the above methods.
+# forecastYears and terminalValue switch from the one year projection to a multi year
+# forecast (see FORECAST_YEARS)
+@instrumented("computations")
+def computations(metrics, prevMetrics, forecastYears=FORECAST_YEARS, terminalValue=TERMINAL_VALUE):
     computations = {}
+    # The current year is looked up dozens of times below, the previous year only a few
+    if isinstance(metrics, MetricsRecord):
+        metrics = metrics.as_dict()
 
     # Non Operating Profit Less Adjusted for Taxes
     NOPLAT = (metrics["ebitda"]) * (1 - (metrics["incomeTaxExpense"] / metrics["ebitda"]))
@@ -292,10 +697,18 @@ def computations(metrics, prevMetrics):
     discountedFreeCashFlow = computations["operatingFreeCashFlow"] * computations["discountFactor"]
     computations["discountedFreeCashFlow"] = discountedFreeCashFlow
 
-    # Multiply by 0.9 to account for overestimation as many companies had
+    # Multiply by ENTERPRISE_VALUE_HAIRCUT to account for overestimation as many companies had
     # very profitable years during covid. The flip side is that some also
     # had very rough years. These projections are incredibly rough
-    netEntepriseValue = abs(computations["discountedFreeCashFlow"] + future_discounted_free_cash_flow(metrics, projected_metrics(metrics, prevMetrics))) * 0.7
+    if forecastYears is None:
+        netEntepriseValue = abs(computations["discountedFreeCashFlow"] + future_discounted_free_cash_flow(metrics, projected_metrics(metrics, prevMetrics))) * ENTERPRISE_VALUE_HAIRCUT
+    else:
+        forecast = forecast_enterprise_value(metrics, prevMetrics, computations["WACC"], forecastYears, terminalValue)
+        for key, value in forecast.items():
+            computations[key] = float(value)
+        if not math.isfinite(computations["presentValueOfForecast"] + computations["presentValueOfTerminalValue"]):
+            raise ValueError("Forecast is not computable, the WACC has to exceed the terminal growth rate")
+        netEntepriseValue = (computations["presentValueOfForecast"] + computations["presentValueOfTerminalValue"]) * ENTERPRISE_VALUE_HAIRCUT
     computations["netEntepriseValue"] = netEntepriseValue
 
     # Value changes here for some reason when I take the absolute value of the netEnterpriseValue
@@ -330,18 +743,79 @@ def computations(metrics, prevMetrics):
 # a single year's trend, making it not very useful. However, this is the best method without spending
 # $10,000 on the Bloomberg terminal or creating a neural network to predict my data.
 # This is also the reason why my program is not awfully accurate.
+# Metrics that either year doesn't have, or that are zero this year, can't be projected and
+# are left missing in what is returned, a record for records and a dict for the plain dicts
+# computations passes. The macro assumptions carry over unchanged
 def projected_metrics(metrics, prevMetrics):
-    projectedMetrics = {}
+    if isinstance(metrics, MetricsRecord):
+        projectedMetrics = MetricsRecord(assumptions=metrics.assumptions)
+        currentValue = functools.partial(getattr, metrics)
+    else:
+        projectedMetrics = {name: metrics[name] for name in MACRO_ASSUMPTION_NAMES if name in metrics}
+        currentValue = metrics.get
+    # A missing slot reads as None like a missing key of a dict
+    previousValue = functools.partial(getattr, prevMetrics) if isinstance(prevMetrics, MetricsRecord) else prevMetrics.get
 
     # Finding rate of change of metrics compared to year previous to project
-    for key in metrics:
-        if metrics[key] != 0:
-            try:
-                projectedMetrics[key] = (1 + ((metrics[key] - prevMetrics[key])/metrics[key])) * metrics[key]
-            except KeyError:
-                1 + 1
+    for key in METRIC_FIELDS[1:]:
+        current = currentValue(key, None)
+        previous = previousValue(key, None)
+        if current is not None and previous is not None and current != 0:
+            projectedMetrics[key] = (1 + ((current - previous)/current)) * current
     return projectedMetrics
 
+# Discount factor of every forecast year, 1 / (1 + WACC) ** year, computed once up front.
+# Years are on the last axis so a whole universe is discounted in one operation
+def discount_factors(wacc, years):
+    wacc = np.asarray(wacc, dtype=np.float64)[..., np.newaxis]
+    return np.power(1 + wacc, -np.arange(1, years + 1, dtype=np.float64))
+
+# Extends a metric over the forecast horizon by compounding last year's rate of change,
+# (1 + growth) ** year. The first year is the same value projected_metrics gives
+def growth_path(current, previous, years):
+    current = np.asarray(current, dtype=np.float64)[..., np.newaxis]
+    previous = np.asarray(previous, dtype=np.float64)[..., np.newaxis]
+    growth = (current - previous) / current
+    return current * np.power(1 + growth, np.arange(1, years + 1, dtype=np.float64))
+
+# Present value of an explicit forecast of the operating free cash flow over the given number
+# of years plus a terminal value, all discounted at wacc. Works on single values or on whole
+# columns of tickers; anything that can't be computed comes back as NaN
+def forecast_enterprise_value(metrics, prevMetrics, wacc, years, terminalValue=TERMINAL_VALUE,
+                              terminalGrowthRate=TERMINAL_GROWTH_RATE, exitMultiple=EXIT_MULTIPLE):
+    if years < 1:
+        raise ValueError("The forecast needs at least one year")
+    wacc = np.asarray(wacc, dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        paths = {}
+        for name in ("ebitda", "incomeTaxExpense", "totalCurrentAssets", "totalCurrentLiabilities"):
+            paths[name] = growth_path(metrics[name], prevMetrics[name], years)
+        NOPLAT = paths["ebitda"] * (1 - (paths["incomeTaxExpense"] / paths["ebitda"]))
+        investedCapital = paths["totalCurrentAssets"] - paths["totalCurrentLiabilities"]
+        currentInvestedCapital = np.asarray(metrics["totalCurrentAssets"] - metrics["totalCurrentLiabilities"], dtype=np.float64)
+        newNetInvestment = np.diff(investedCapital, axis=-1, prepend=currentInvestedCapital[..., np.newaxis])
+        operatingFreeCashFlow = NOPLAT - newNetInvestment
+
+        factors = discount_factors(wacc, years)
+        presentValueOfForecast = (operatingFreeCashFlow * factors).sum(axis=-1)
+
+        if terminalValue == "gordon":
+            terminal = operatingFreeCashFlow[..., -1] * (1 + terminalGrowthRate) / (wacc - terminalGrowthRate)
+            terminal = np.where(wacc > terminalGrowthRate, terminal, np.nan)
+        elif terminalValue == "exit":
+            terminal = paths["ebitda"][..., -1] * exitMultiple
+        elif terminalValue is None:
+            terminal = np.zeros_like(presentValueOfForecast)
+        else:
+            raise ValueError("Unknown terminal value: " + str(terminalValue))
+
+    return {
+        "presentValueOfForecast": presentValueOfForecast,
+        "terminalValue": terminal,
+        "presentValueOfTerminalValue": terminal * factors[..., -1],
+    }
+
 # Using the projected metrics and data from the current year, I calculate the discounted
 # free cash flow in the following years, which is integral to my final calculation. This is
 # where my inaccuracy begins.
@@ -392,33 +866,852 @@ def future_discounted_free_cash_flow(prevMetrics, metrics):
 
     return discountedFreeCashFlow
 
-# Parse my data from JSON files. Taken from Financial Modelling Prep
-def get_jsonparsed_data(url):
-    # Sourced from Financial Modeling Prep
-    response = urlopen(url)
-    data = response.read().decode("utf-8")
-    return json.loads(data)
+# Metrics the batch valuation reads for the current year and for the previous year. Only
+# the previous year metrics are projected forward
+BATCH_METRICS = (
+    "ebitda", "incomeTaxExpense", "totalCurrentAssets", "totalCurrentLiabilities", "revenue",
+    "averageBeta", "longTermDebt", "marketCap", "cashAndCashEquivalents", "otherNonCurrentAssets",
+    "otherCurrentAssets", "commercialPaper", "netDebt", "outstandingShares",
+    "riskFreeRatePerAnnum", "expectedReturnOfTheMarketPerAnnum", "AABondEffectiveYield",
+)
+BATCH_PREVIOUS_METRICS = ("ebitda", "incomeTaxExpense", "totalCurrentAssets", "totalCurrentLiabilities", "revenue", "longTermDebt")
+
+# Used when a batch doesn't carry its own column for these metrics
+BATCH_DEFAULTS = {
+    "commercialPaper": 0.0,
+    "riskFreeRatePerAnnum": RISK_FREE_RATE_PER_ANNUM,
+    "expectedReturnOfTheMarketPerAnnum": EXPECTED_RETURN_OF_THE_MARKET_PER_ANNUM,
+    "AABondEffectiveYield": AA_BOND_EFFECTIVE_YIELD,
+}
+
+# Turns a list of metrics (one per ticker, as returned by isolate_data) into columns.
+# Metrics a ticker doesn't have become NaN, which the batch valuation masks out. Keeping the
+# records in a MetricsTable instead gives the same columns without building new arrays
+def stack_metrics(metricsList, names=BATCH_METRICS):
+    columns = {}
+    for name in names:
+        columns[name] = np.array([metrics.get(name, np.nan) for metrics in metricsList], dtype=np.float64)
+    return columns
+
+# Reads one metric out of a batch. Anything indexable by name works, such as a dict of
+# arrays or a DataFrame, and a plain number is broadcast to every ticker
+def as_column(metrics, name):
+    if name in metrics:
+        return np.asarray(metrics[name], dtype=np.float64)
+    if name in BATCH_DEFAULTS:
+        return np.asarray(BATCH_DEFAULTS[name], dtype=np.float64)
+    raise KeyError(name)
+
+# Vectorized version of projected_metrics for the metrics the future cash flow needs. A
+# metric that is zero this year can't be projected and becomes NaN
+def batch_projected_metrics(metrics, prevMetrics):
+    projectedMetrics = {}
+    for name in BATCH_PREVIOUS_METRICS:
+        current = metrics[name]
+        projectedMetrics[name] = np.where(current != 0, (1 + ((current - prevMetrics[name]) / current)) * current, np.nan)
+    return projectedMetrics
 
-# This next method is isolated as the API returned the data in a strange format
-# making it difficult to sift through along with the other returned files
-def share_price(ticker, metrics):
+# Vectorized version of future_discounted_free_cash_flow. Returns all of its intermediate
+# values rather than just the discounted free cash flow. A wacc replaces the computed one
+def batch_future_discounted_free_cash_flow(prevMetrics, metrics, wacc=None):
+    computations = {}
+    computations["NOPLAT"] = (metrics["ebitda"]) * (1 - (metrics["incomeTaxExpense"] / metrics["ebitda"]))
+    computations["investedCapital"] = (metrics["totalCurrentAssets"] - metrics["totalCurrentLiabilities"])
+    computations["investedCapitalOverRevenue"] = computations["investedCapital"] / metrics["revenue"]
+    computations["investedCapitalPrevYear"] = (prevMetrics["totalCurrentAssets"] - prevMetrics["totalCurrentLiabilities"])
+    computations["newNetInvestment"] = computations["investedCapital"] - computations["investedCapitalPrevYear"]
+    computations["operatingFreeCashFlow"] = computations["NOPLAT"] - computations["newNetInvestment"]
+    computations["leveredRate"] = (prevMetrics["averageBeta"]) * (1 + (metrics["longTermDebt"] / prevMetrics["marketCap"]))
+    computations["averageBeta"] = ((computations["leveredRate"]) + (prevMetrics["averageBeta"])) / 2
+    computations["CAPM"] = prevMetrics["riskFreeRatePerAnnum"] + computations["averageBeta"] * (prevMetrics["expectedReturnOfTheMarketPerAnnum"] - prevMetrics["riskFreeRatePerAnnum"])
+    computations["equityLinkedCostOfCapital"] = prevMetrics["marketCap"] / (metrics["longTermDebt"] + prevMetrics["marketCap"]) * computations["CAPM"]
+    computations["debtLinkedCostOfCapital"] = metrics["longTermDebt"] / (metrics["longTermDebt"] + prevMetrics["marketCap"]) * prevMetrics["AABondEffectiveYield"] * (1 - metrics["incomeTaxExpense"] / metrics["ebitda"])
+    computations["WACC"] = computations["debtLinkedCostOfCapital"] + computations["equityLinkedCostOfCapital"] if wacc is None else wacc
+    computations["discountFactor"] = 1 / (1 + computations["WACC"])
+    computations["discountedFreeCashFlow"] = np.abs(computations["operatingFreeCashFlow"] * computations["discountFactor"])
+
+    # Divisions the scalar version would fail on
+    computations["valid"] = (
+        (metrics["ebitda"] != 0) & (metrics["revenue"] != 0)
+        & (metrics["longTermDebt"] + prevMetrics["marketCap"] != 0) & (1 + computations["WACC"] != 0)
+    )
+    return computations
+
+# Values a whole universe in one pass. metrics and prevMetrics hold one column per metric
+# (see stack_metrics) and every computation from the computations method comes back as an
+# array, along with a "valid" mask. Tickers the scalar version couldn't value, because of a
+# division by zero, a metric that can't be projected or a missing input, are masked out
+# and set to NaN in every array. A wacc replaces the computed WACC of every ticker
+@instrumented("batch_computations")
+def batch_computations(metrics, prevMetrics, forecastYears=FORECAST_YEARS, terminalValue=TERMINAL_VALUE,
+                       wacc=None, terminalGrowthRate=TERMINAL_GROWTH_RATE):
+    metrics = {name: as_column(metrics, name) for name in BATCH_METRICS}
+    prevMetrics = {name: as_column(prevMetrics, name) for name in BATCH_PREVIOUS_METRICS}
+    computations = {}
 
-    sharePriceURL = "https://financialmodelingprep.com/api/v3/historical-price-full/" + ticker + "?serietype=line&apikey=<API_KEY>"
-    sharePrice = get_jsonparsed_data(sharePriceURL)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        computations["NOPLAT"] = (metrics["ebitda"]) * (1 - (metrics["incomeTaxExpense"] / metrics["ebitda"]))
+        computations["investedCapital"] = (metrics["totalCurrentAssets"] - metrics["totalCurrentLiabilities"])
+        computations["investedCapitalOverRevenue"] = computations["investedCapital"] / metrics["revenue"]
+        computations["investedCapitalPrevYear"] = (prevMetrics["totalCurrentAssets"] - prevMetrics["totalCurrentLiabilities"])
+        computations["newNetInvestment"] = computations["investedCapital"] - computations["investedCapitalPrevYear"]
+        computations["operatingFreeCashFlow"] = computations["NOPLAT"] - computations["newNetInvestment"]
+        computations["leveredRate"] = (metrics["averageBeta"]) * (1 + (metrics["longTermDebt"] / metrics["marketCap"]))
+        computations["averageBeta"] = ((computations["leveredRate"]) + (metrics["averageBeta"])) / 2
+        computations["CAPM"] = metrics["riskFreeRatePerAnnum"] + computations["averageBeta"] * (metrics["expectedReturnOfTheMarketPerAnnum"] - metrics["riskFreeRatePerAnnum"])
+        computations["equityLinkedCostOfCapital"] = metrics["marketCap"] / (metrics["longTermDebt"] + metrics["marketCap"]) * computations["CAPM"]
+        computations["debtLinkedCostOfCapital"] = metrics["longTermDebt"] / (metrics["longTermDebt"] + metrics["marketCap"]) * metrics["AABondEffectiveYield"] * (1 - metrics["incomeTaxExpense"] / metrics["ebitda"])
+        computations["WACC"] = computations["debtLinkedCostOfCapital"] + computations["equityLinkedCostOfCapital"]
+        if wacc is not None:
+            computations["WACC"] = np.asarray(wacc, dtype=np.float64)
+        computations["discountFactor"] = 1 / (1 + computations["WACC"])
+        computations["discountedFreeCashFlow"] = computations["operatingFreeCashFlow"] * computations["discountFactor"]
+
+        if forecastYears is None:
+            future = batch_future_discounted_free_cash_flow(metrics, batch_projected_metrics(metrics, prevMetrics), wacc)
+            futureValid = future["valid"]
+            computations["netEntepriseValue"] = np.abs(computations["discountedFreeCashFlow"] + future["discountedFreeCashFlow"]) * ENTERPRISE_VALUE_HAIRCUT
+        else:
+            computations.update(forecast_enterprise_value(metrics, prevMetrics, computations["WACC"], forecastYears, terminalValue, terminalGrowthRate))
+            futureValid = True
+            computations["netEntepriseValue"] = (computations["presentValueOfForecast"] + computations["presentValueOfTerminalValue"]) * ENTERPRISE_VALUE_HAIRCUT
+        computations["VONOANOCMS"] = (metrics["cashAndCashEquivalents"] + metrics["otherNonCurrentAssets"] + metrics["otherCurrentAssets"])
+        computations["grossEnterpriseValue"] = computations["netEntepriseValue"] + computations["VONOANOCMS"]
+        computations["debt"] = (metrics["commercialPaper"] + metrics["netDebt"]) / 10
+        computations["totalValueOfCommonEquity"] = computations["grossEnterpriseValue"] - computations["debt"]
+        computations["DCFValuePerShare"] = computations["totalValueOfCommonEquity"] / metrics["outstandingShares"] * 10
+
+        valid = (
+            futureValid & (metrics["ebitda"] != 0) & (metrics["revenue"] != 0) & (metrics["marketCap"] != 0)
+            & (metrics["longTermDebt"] + metrics["marketCap"] != 0) & (1 + computations["WACC"] != 0)
+            & (metrics["outstandingShares"] != 0) & np.isfinite(computations["DCFValuePerShare"])
+        )
+        for name in computations:
+            computations[name] = np.where(valid, computations[name], np.nan)
+
+    computations["valid"] = valid
+    return computations
 
-    # Create a range of possible dates as the API doesn't have every single day
-    # The range is between five days (+/-) of the income statement's release
-    date = metrics["date"]
-    dateRange = []
-    for i in range(-10,10):
-        dateRange.append(str(date[:7] + str(int(date[7:]) + i)))
+# Point estimate of every assumption the Monte Carlo valuation can simulate
+def simulation_point_estimates(metrics, prevMetrics):
+    riskFreeRate = as_column(metrics, "riskFreeRatePerAnnum")
+    return {
+        "averageBeta": as_column(metrics, "averageBeta"),
+        "marketPremium": as_column(metrics, "expectedReturnOfTheMarketPerAnnum") - riskFreeRate,
+        "AABondEffectiveYield": as_column(metrics, "AABondEffectiveYield"),
+        "ebitdaGrowth": (as_column(metrics, "ebitda") - as_column(prevMetrics, "ebitda")) / as_column(metrics, "ebitda"),
+    }
+
+# Replaces the assumptions behind a valuation with simulated or swept values. Growth rates
+# are applied through last year's metrics, as growth = (current - previous) / current means
+# previous = current * (1 - growth)
+def apply_assumptions(metrics, prevMetrics, assumptions):
+    metrics = dict(metrics)
+    prevMetrics = dict(prevMetrics)
+    if "averageBeta" in assumptions:
+        metrics["averageBeta"] = assumptions["averageBeta"]
+    if "marketPremium" in assumptions:
+        metrics["expectedReturnOfTheMarketPerAnnum"] = metrics["riskFreeRatePerAnnum"] + assumptions["marketPremium"]
+    if "AABondEffectiveYield" in assumptions:
+        metrics["AABondEffectiveYield"] = assumptions["AABondEffectiveYield"]
+    if "ebitdaGrowth" in assumptions:
+        prevMetrics["ebitda"] = metrics["ebitda"] * (1 - assumptions["ebitdaGrowth"])
+    return metrics, prevMetrics
+
+def draw(generator, distribution, pointEstimate, size):
+    kind, parameters = distribution[0], distribution[1:]
+    if kind == "normal":
+        mean = pointEstimate if parameters[0] is None else parameters[0]
+        return generator.normal(mean, parameters[1], size)
+    if kind == "uniform":
+        return generator.uniform(parameters[0], parameters[1], size)
+    if kind == "triangular":
+        mode = pointEstimate if parameters[1] is None else parameters[1]
+        return generator.triangular(parameters[0], mode, parameters[2], size)
+    if kind == "fixed":
+        return np.full(size, parameters[0], dtype=np.float64)
+    raise ValueError("Unknown distribution: " + str(kind))
+
+# Values one company over many random draws of beta, the market premium, the AA bond yield
+# and EBITDA growth, and returns percentiles of DCFValuePerShare. Drawn growth
+# rates replace last year's values so the projection grows by exactly that rate. Every
+# assumption gets its own random stream derived from seed, so a seed gives the same
+# result whatever the chunk size
+def monte_carlo_valuation(metrics, prevMetrics, draws=MONTE_CARLO_DRAWS, distributions=None, seed=None,
+                          chunkSize=MONTE_CARLO_CHUNK_SIZE, percentiles=MONTE_CARLO_PERCENTILES,
+                          forecastYears=FORECAST_YEARS, terminalValue=TERMINAL_VALUE):
+    if distributions is None:
+        distributions = MONTE_CARLO_DISTRIBUTIONS
+    noEffect = sorted(set(distributions) & set(NO_EFFECT_ASSUMPTIONS))
+    if noEffect:
+        raise ValueError("Can't simulate " + noEffect[0] + ": " + NO_EFFECT_ASSUMPTIONS[noEffect[0]])
+    unknown = set(distributions) - set(MONTE_CARLO_DISTRIBUTIONS)
+    if unknown:
+        raise ValueError("Can't simulate: " + ", ".join(sorted(unknown)))
+
+    pointEstimates = simulation_point_estimates(metrics, prevMetrics)
+    names = sorted(distributions)
+    generators = [np.random.default_rng(stream) for stream in np.random.SeedSequence(seed).spawn(len(names))]
+    baseMetrics = {name: as_column(metrics, name) for name in BATCH_METRICS}
+    basePrevMetrics = {name: as_column(prevMetrics, name) for name in BATCH_PREVIOUS_METRICS}
+
+    values = np.empty(draws, dtype=np.float64)
+    for start in range(0, draws, chunkSize):
+        size = min(chunkSize, draws - start)
+        sample = {name: draw(generator, distributions[name], pointEstimates[name], size) for name, generator in zip(names, generators)}
+        chunkMetrics, chunkPrevMetrics = apply_assumptions(baseMetrics, basePrevMetrics, sample)
+        result = batch_computations(chunkMetrics, chunkPrevMetrics, forecastYears, terminalValue)
+        values[start:start + size] = np.broadcast_to(result["DCFValuePerShare"], size)
+
+    valid = values[np.isfinite(values)]
+    summary = {"draws": draws, "validDraws": int(valid.size)}
+    if valid.size:
+        summary["mean"] = float(valid.mean())
+        summary["percentiles"] = dict(zip(percentiles, (float(value) for value in np.percentile(valid, percentiles))))
+    else:
+        summary["mean"] = math.nan
+        summary["percentiles"] = {percentile: math.nan for percentile in percentiles}
+    return summary
+
+# Assumptions a sensitivity grid can sweep. Sweeping the WACC replaces the one computed from
+# beta, the market premium and the bond yield, so it can't be combined with those
+SENSITIVITY_ASSUMPTIONS = tuple(MONTE_CARLO_DISTRIBUTIONS) + ("WACC", "terminalGrowthRate")
+
+# Assumptions that only enter the valuation through the computed WACC
+WACC_ASSUMPTIONS = ("averageBeta", "marketPremium", "AABondEffectiveYield")
+
+# Values one company over every combination of the given assumption values, e.g.
+# axes={"WACC": [...], "terminalGrowthRate": [...]}. Each axis is laid along its own dimension
+# so the whole grid is one broadcast computation, and everything that doesn't depend on a
+# swept assumption (NOPLAT, invested capital, ...) is only computed once. Returns the axes
+# along with DCFValuePerShare and a valid mask shaped like the grid
+def sensitivity_grid(metrics, prevMetrics, axes, forecastYears=FORECAST_YEARS, terminalValue=TERMINAL_VALUE):
+    # Axes that would have no effect and leave the grid flat along them
+    noEffect = sorted(set(axes) & set(NO_EFFECT_ASSUMPTIONS))
+    if noEffect:
+        raise ValueError("Can't sweep " + noEffect[0] + ": " + NO_EFFECT_ASSUMPTIONS[noEffect[0]])
+    unknown = set(axes) - set(SENSITIVITY_ASSUMPTIONS)
+    if unknown:
+        raise ValueError("Can't sweep: " + ", ".join(sorted(unknown)))
+    if "terminalGrowthRate" in axes and not (forecastYears and terminalValue == "gordon"):
+        raise ValueError("Sweeping terminalGrowthRate needs a forecast horizon with a Gordon growth terminal value")
+    overridden = set(axes) & set(WACC_ASSUMPTIONS)
+    if "WACC" in axes and overridden:
+        raise ValueError("A swept WACC replaces the one computed from " + ", ".join(sorted(overridden)))
+
+    axes = {name: np.asarray(values, dtype=np.float64).ravel() for name, values in axes.items()}
+    shape = tuple(len(values) for values in axes.values())
+    assumptions = {}
+    for position, (name, values) in enumerate(axes.items()):
+        axisShape = [1] * len(axes)
+        axisShape[position] = len(values)
+        assumptions[name] = values.reshape(axisShape)
+
+    baseMetrics = {name: as_column(metrics, name) for name in BATCH_METRICS}
+    basePrevMetrics = {name: as_column(prevMetrics, name) for name in BATCH_PREVIOUS_METRICS}
+    gridMetrics, gridPrevMetrics = apply_assumptions(baseMetrics, basePrevMetrics, assumptions)
+    result = batch_computations(gridMetrics, gridPrevMetrics, forecastYears, terminalValue,
+                                wacc=assumptions.get("WACC"),
+                                terminalGrowthRate=assumptions.get("terminalGrowthRate", TERMINAL_GROWTH_RATE))
+
+    return {
+        "axes": axes,
+        "DCFValuePerShare": np.broadcast_to(result["DCFValuePerShare"], shape),
+        "valid": np.broadcast_to(result["valid"], shape),
+    }
+
+# Lays a two dimensional sensitivity grid out as a DataFrame, with the first axis as the
+# rows and the second as the columns, ready to be drawn as a heatmap
+def sensitivity_frame(grid):
+    import pandas as pd
+
+    if len(grid["axes"]) != 2:
+        raise ValueError("Only two dimensional grids can be laid out as a table")
+    (rowName, rows), (columnName, columns) = grid["axes"].items()
+    frame = pd.DataFrame(grid["DCFValuePerShare"], index=pd.Index(rows, name=rowName), columns=pd.Index(columns, name=columnName))
+    return frame
+
+# The computations method written out as a dependency graph. Every node names the values it
+# is computed from: inputs are "metrics.<name>" and "prevMetrics.<name>", "projected.<name>"
+# is a metric projected one year ahead and "future.<name>" belongs to the discounted free
+# cash flow of that projected year. The formulas are the same as in computations and
+# future_discounted_free_cash_flow and work on single values or whole columns of tickers
+VALUATION_NODES = {
+    "NOPLAT": (("metrics.ebitda", "metrics.incomeTaxExpense"), lambda ebitda, incomeTaxExpense: (ebitda) * (1 - (incomeTaxExpense / ebitda))),
+    "investedCapital": (("metrics.totalCurrentAssets", "metrics.totalCurrentLiabilities"), lambda assets, liabilities: (assets - liabilities)),
+    "investedCapitalOverRevenue": (("investedCapital", "metrics.revenue"), lambda investedCapital, revenue: investedCapital / revenue),
+    "investedCapitalPrevYear": (("prevMetrics.totalCurrentAssets", "prevMetrics.totalCurrentLiabilities"), lambda assets, liabilities: (assets - liabilities)),
+    "newNetInvestment": (("investedCapital", "investedCapitalPrevYear"), lambda investedCapital, investedCapitalPrevYear: investedCapital - investedCapitalPrevYear),
+    "operatingFreeCashFlow": (("NOPLAT", "newNetInvestment"), lambda NOPLAT, newNetInvestment: NOPLAT - newNetInvestment),
+    "leveredRate": (("metrics.averageBeta", "metrics.longTermDebt", "metrics.marketCap"), lambda beta, longTermDebt, marketCap: (beta) * (1 + (longTermDebt / marketCap))),
+    "averageBeta": (("leveredRate", "metrics.averageBeta"), lambda leveredRate, beta: ((leveredRate) + (beta)) / 2),
+    "CAPM": (("metrics.riskFreeRatePerAnnum", "averageBeta", "metrics.expectedReturnOfTheMarketPerAnnum"), lambda riskFree, averageBeta, marketReturn: riskFree + averageBeta * (marketReturn - riskFree)),
+    "equityLinkedCostOfCapital": (("metrics.marketCap", "metrics.longTermDebt", "CAPM"), lambda marketCap, longTermDebt, CAPM: marketCap / (longTermDebt + marketCap) * CAPM),
+    "debtLinkedCostOfCapital": (("metrics.longTermDebt", "metrics.marketCap", "metrics.AABondEffectiveYield", "metrics.incomeTaxExpense", "metrics.ebitda"),
+                                lambda longTermDebt, marketCap, bondYield, incomeTaxExpense, ebitda: longTermDebt / (longTermDebt + marketCap) * bondYield * (1 - incomeTaxExpense / ebitda)),
+    "WACC": (("debtLinkedCostOfCapital", "equityLinkedCostOfCapital"), lambda debtLinked, equityLinked: debtLinked + equityLinked),
+    "discountFactor": (("WACC",), lambda WACC: 1 / (1 + WACC)),
+    "discountedFreeCashFlow": (("operatingFreeCashFlow", "discountFactor"), lambda operatingFreeCashFlow, discountFactor: operatingFreeCashFlow * discountFactor),
+
+    "future.NOPLAT": (("projected.ebitda", "projected.incomeTaxExpense"), lambda ebitda, incomeTaxExpense: (ebitda) * (1 - (incomeTaxExpense / ebitda))),
+    "future.investedCapital": (("projected.totalCurrentAssets", "projected.totalCurrentLiabilities"), lambda assets, liabilities: (assets - liabilities)),
+    "future.investedCapitalOverRevenue": (("future.investedCapital", "projected.revenue"), lambda investedCapital, revenue: investedCapital / revenue),
+    # The year before the projected one is the current year
+    "future.newNetInvestment": (("future.investedCapital", "investedCapital"), lambda investedCapital, investedCapitalPrevYear: investedCapital - investedCapitalPrevYear),
+    "future.operatingFreeCashFlow": (("future.NOPLAT", "future.newNetInvestment"), lambda NOPLAT, newNetInvestment: NOPLAT - newNetInvestment),
+    "future.leveredRate": (("metrics.averageBeta", "projected.longTermDebt", "metrics.marketCap"), lambda beta, longTermDebt, marketCap: (beta) * (1 + (longTermDebt / marketCap))),
+    "future.averageBeta": (("future.leveredRate", "metrics.averageBeta"), lambda leveredRate, beta: ((leveredRate) + (beta)) / 2),
+    "future.CAPM": (("metrics.riskFreeRatePerAnnum", "future.averageBeta", "metrics.expectedReturnOfTheMarketPerAnnum"), lambda riskFree, averageBeta, marketReturn: riskFree + averageBeta * (marketReturn - riskFree)),
+    "future.equityLinkedCostOfCapital": (("metrics.marketCap", "projected.longTermDebt", "future.CAPM"), lambda marketCap, longTermDebt, CAPM: marketCap / (longTermDebt + marketCap) * CAPM),
+    "future.debtLinkedCostOfCapital": (("projected.longTermDebt", "metrics.marketCap", "metrics.AABondEffectiveYield", "projected.incomeTaxExpense", "projected.ebitda"),
+                                       lambda longTermDebt, marketCap, bondYield, incomeTaxExpense, ebitda: longTermDebt / (longTermDebt + marketCap) * bondYield * (1 - incomeTaxExpense / ebitda)),
+    "future.WACC": (("future.debtLinkedCostOfCapital", "future.equityLinkedCostOfCapital"), lambda debtLinked, equityLinked: debtLinked + equityLinked),
+    "future.discountFactor": (("future.WACC",), lambda WACC: 1 / (1 + WACC)),
+    "future.discountedFreeCashFlow": (("future.operatingFreeCashFlow", "future.discountFactor"), lambda operatingFreeCashFlow, discountFactor: abs(operatingFreeCashFlow * discountFactor)),
+
+    "netEntepriseValue": (("discountedFreeCashFlow", "future.discountedFreeCashFlow"), lambda discounted, futureDiscounted: abs(discounted + futureDiscounted) * ENTERPRISE_VALUE_HAIRCUT),
+    "VONOANOCMS": (("metrics.cashAndCashEquivalents", "metrics.otherNonCurrentAssets", "metrics.otherCurrentAssets"), lambda cash, otherNonCurrent, otherCurrent: (cash + otherNonCurrent + otherCurrent)),
+    "grossEnterpriseValue": (("netEntepriseValue", "VONOANOCMS"), lambda netEntepriseValue, VONOANOCMS: netEntepriseValue + VONOANOCMS),
+    "debt": (("metrics.commercialPaper", "metrics.netDebt"), lambda commercialPaper, netDebt: (commercialPaper + netDebt) / 10),
+    "totalValueOfCommonEquity": (("grossEnterpriseValue", "debt"), lambda grossEnterpriseValue, debt: grossEnterpriseValue - debt),
+    "DCFValuePerShare": (("totalValueOfCommonEquity", "metrics.outstandingShares"), lambda totalValueOfCommonEquity, outstandingShares: totalValueOfCommonEquity / outstandingShares * 10),
+}
+
+# Metrics projected one year ahead the same way projected_metrics does it
+for name in BATCH_PREVIOUS_METRICS:
+    VALUATION_NODES["projected." + name] = (("metrics." + name, "prevMetrics." + name), lambda current, previous: (1 + ((current - previous) / current)) * current)
+
+# Keys the computations method returns, in the same order
+COMPUTATION_NAMES = (
+    "NOPLAT", "investedCapital", "investedCapitalOverRevenue", "investedCapitalPrevYear", "newNetInvestment",
+    "operatingFreeCashFlow", "leveredRate", "averageBeta", "CAPM", "equityLinkedCostOfCapital",
+    "debtLinkedCostOfCapital", "WACC", "discountFactor", "discountedFreeCashFlow", "netEntepriseValue",
+    "VONOANOCMS", "grossEnterpriseValue", "debt", "totalValueOfCommonEquity", "DCFValuePerShare",
+)
+
+# Keeps every computed node of a valuation so that changing an input, like a new risk free
+# rate, only recomputes the nodes downstream of it. The inputs can be single values for one
+# company or columns for a whole universe
+class ValuationGraph:
+    def __init__(self, metrics, prevMetrics, nodes=VALUATION_NODES):
+        self.nodes = nodes
+        self.inputs = {}
+        for name, value in metrics.items():
+            self.inputs["metrics." + name] = value
+        for name, value in prevMetrics.items():
+            self.inputs["prevMetrics." + name] = value
+        self.values = {}
+        self.evaluations = 0
+
+        self.dependents = {}
+        for name, (dependencies, _) in nodes.items():
+            for dependency in dependencies:
+                self.dependents.setdefault(dependency, []).append(name)
+
+    # Returns the value of a node, computing it and whatever it depends on if needed
+    def get(self, name):
+        if name in self.inputs:
+            return self.inputs[name]
+        if name in self.values:
+            return self.values[name]
+        if name not in self.nodes:
+            raise KeyError(name)
+        dependencies, formula = self.nodes[name]
+        value = formula(*[self.get(dependency) for dependency in dependencies])
+        self.values[name] = value
+        self.evaluations += 1
+        return value
+
+    # Changes an input, e.g. set_input("metrics.riskFreeRatePerAnnum", 0.02), and forgets every
+    # node computed from it. Returns the names of the nodes that have to be recomputed
+    def set_input(self, name, value):
+        if name not in self.inputs:
+            raise KeyError(name)
+        self.inputs[name] = value
+        invalidated = set()
+        pending = list(self.dependents.get(name, ()))
+        while pending:
+            node = pending.pop()
+            if node in invalidated:
+                continue
+            invalidated.add(node)
+            self.values.pop(node, None)
+            pending.extend(self.dependents.get(node, ()))
+        return invalidated
+
+    # The same dictionary the computations method returns
+    def computations(self):
+        return {name: self.get(name) for name in COMPUTATION_NAMES}
+
+    # How a node was derived: every node it depends on, in the order they are computed,
+    # as (name, value, {dependency: value})
+    def trace(self, name):
+        steps = []
+        visited = set()
+
+        def visit(node):
+            if node in visited or node in self.inputs:
+                return
+            visited.add(node)
+            dependencies = self.nodes[node][0]
+            for dependency in dependencies:
+                visit(dependency)
+            steps.append((node, self.get(node), {dependency: self.get(dependency) for dependency in dependencies}))
+
+        visit(name)
+        return steps
+
+# Raised in offline mode when a response was never cached
+class CacheMissError(ValueError):
+    pass
+
+# Parse my data from JSON files. Taken from Financial Modelling Prep. Responses are served
+# from the on-disk cache while they are fresh and written back to it after a download
+@instrumented("get_jsonparsed_data")
+def get_jsonparsed_data(url):
+    if not CACHE_ENABLED and not OFFLINE_MODE:
+        return json.loads(scheduled_download(url))
+
+    endpoint, key = cache_key(url)
+    ttl = CACHE_TTL_SECONDS.get(endpoint, DEFAULT_CACHE_TTL_SECONDS)
+    cached = read_cache(key, None if OFFLINE_MODE else ttl)
+    if INSTRUMENTATION_ENABLED:
+        instrumentation.count_cache(cached is not None)
+    if cached is not None:
+        return cached
+    if OFFLINE_MODE:
+        raise CacheMissError("No cached response for " + key)
+
+    text = scheduled_download(url)
+    data = json.loads(text)
+    # The API answers bad requests with an error message rather than an HTTP error,
+    # which shouldn't be replayed later
+    if not (isinstance(data, dict) and "Error Message" in data):
+        write_cache(key, text)
+    return data
+
+# Priority of a request. Interactive ones, like a ticker typed in or asked for through the
+# service, get the next free request before background screens, backtests and refreshes
+INTERACTIVE = 0
+BACKGROUND = 1
+
+requestPriority = threading.local()
+
+def current_priority():
+    return getattr(requestPriority, "value", INTERACTIVE)
+
+# Requests made by this thread inside the block get the given priority
+@contextlib.contextmanager
+def request_priority(priority):
+    previous = current_priority()
+    requestPriority.value = priority
+    try:
+        yield
+    finally:
+        requestPriority.value = previous
+
+# Calls a function with background priority, for work handed to a pool of threads
+def in_background(function, *args, **kwargs):
+    with request_priority(BACKGROUND):
+        return function(*args, **kwargs)
+
+# Raised when the API still throttles a request after every retry. It is an OSError like
+# any other network failure, so a throttled ticker isn't mistaken for one with bad data
+class RateLimitError(OSError):
+    pass
+
+# Token bucket shared by every thread. A request takes a token, tokens come back at the
+# rate the plan allows up to the burst size, and requests waiting for one are served by
+# priority, then in the order they asked. When the API throttles anyway, every request
+# holds off for as long as it asked and the rate is halved, then it creeps back up to the
+# plan's rate with every request that gets through
+class RequestScheduler:
+    def __init__(self, ratePerMinute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST):
+        self.rate = ratePerMinute / 60 if ratePerMinute else None
+        self.maximumRate = self.rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.resumeAt = 0.0
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.sequence = itertools.count()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=INTERACTIVE):
+        if self.rate is None:
+            return
+        with self.condition:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.refill(now)
+                    if self.waiting[0] != ticket:
+                        self.condition.wait()
+                    elif now < self.resumeAt or self.tokens < 1:
+                        self.condition.wait(max(self.resumeAt - now, (1 - self.tokens) / self.rate))
+                    else:
+                        self.tokens -= 1
+                        return
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+    def slow_down(self, seconds):
+        if self.rate is None:
+            return
+        with self.condition:
+            now = time.monotonic()
+            self.refill(now)
+            self.resumeAt = max(self.resumeAt, now + seconds)
+            self.tokens = min(self.tokens, 0.0)
+            self.rate = max(self.rate / 2, self.maximumRate / 100)
+
+    def speed_up(self):
+        if self.rate is None or self.rate >= self.maximumRate:
+            return
+        with self.condition:
+            self.rate = min(self.maximumRate, self.rate + self.maximumRate / 100)
+
+scheduler = RequestScheduler()
+
+# The API sometimes reports a spent quota in the body of a normal response
+def throttled(text):
+    return text.startswith('{') and "Limit Reach" in text[:200]
+
+# Waits at least as long as the API asked for in Retry-After
+def retry_delay(attempt, retryAfter=None):
+    delay = RETRY_BACKOFF_SECONDS * 2 ** attempt
+    try:
+        return max(delay, float(retryAfter))
+    except (TypeError, ValueError):
+        return delay
+
+# Downloads a response once the scheduler lets it through, retrying throttled requests and
+# server errors with an exponential backoff
+def scheduled_download(url):
+    from urllib.error import HTTPError
+
+    if API_BASE_URL != "https://financialmodelingprep.com" and url.startswith("https://financialmodelingprep.com"):
+        url = API_BASE_URL + url[len("https://financialmodelingprep.com"):]
+    for attempt in range(RETRY_ATTEMPTS + 1):
+        scheduler.acquire(current_priority())
+        try:
+            text = timed_download(url)
+        except HTTPError as error:
+            if error.code != 429 and error.code < 500:
+                raise
+            if attempt == RETRY_ATTEMPTS:
+                if error.code == 429:
+                    raise RateLimitError("Still throttled after %d retries: %s" % (RETRY_ATTEMPTS, cache_key(url)[1])) from error
+                raise
+            reason, delay = error.code, retry_delay(attempt, error.headers.get("Retry-After") if error.headers else None)
+        else:
+            if not throttled(text):
+                scheduler.speed_up()
+                return text
+            if attempt == RETRY_ATTEMPTS:
+                raise RateLimitError("Still throttled after %d retries: %s" % (RETRY_ATTEMPTS, cache_key(url)[1]))
+            reason, delay = 429, retry_delay(attempt)
+        if reason == 429:
+            scheduler.slow_down(delay)
+        if INSTRUMENTATION_ENABLED:
+            instrumentation.count_retry(cache_key(url)[0], reason)
+        time.sleep(delay)
+
+# Downloads a response, recording its latency and size by endpoint when instrumented
+def timed_download(url):
+    if not INSTRUMENTATION_ENABLED:
+        return download(url)
+    start = time.perf_counter()
+    text = download(url)
+    instrumentation.observe_request(cache_key(url)[0], time.perf_counter() - start, len(text))
+    return text
+
+# Connections are kept open per thread and per host so consecutive requests skip the
+# TCP and TLS handshakes
+connectionPool = threading.local()
+
+# A forked process, like a worker of a process pool, opens its own connections instead of
+# talking over the sockets it inherited from its parent
+def reset_connections():
+    global connectionPool
+    connectionPool = threading.local()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_connections)
+
+def get_connection(scheme, host):
+    import http.client
+
+    connections = getattr(connectionPool, "connections", None)
+    if connections is None:
+        connections = connectionPool.connections = {}
+    connection = connections.get((scheme, host))
+    if connection is None:
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, timeout=HTTP_TIMEOUT_SECONDS)
+        else:
+            connection = http.client.HTTPConnection(host, timeout=HTTP_TIMEOUT_SECONDS)
+        connections[(scheme, host)] = connection
+    return connection
+
+def drop_connection(scheme, host):
+    connection = connectionPool.connections.pop((scheme, host), None)
+    if connection is not None:
+        connection.close()
+
+# Sourced from Financial Modeling Prep. Reuses the thread's open connection to the host and
+# reconnects once if the server closed it while it was idle. The HTTP modules are imported
+# here so valuing from the cache or the fundamentals store never loads them
+def download(url):
+    import http.client
+    from urllib.error import HTTPError
+
+    parts = urlsplit(url)
+    target = parts.path + ("?" + parts.query if parts.query else "")
+    for attempt in range(2):
+        connection = get_connection(parts.scheme, parts.netloc)
+        try:
+            connection.request("GET", target, headers={"Accept-Encoding": "identity"})
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionError):
+            drop_connection(parts.scheme, parts.netloc)
+            if attempt == 1:
+                raise
+            continue
+        if response.will_close:
+            drop_connection(parts.scheme, parts.netloc)
+        if response.status != 200:
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+        return body.decode("utf-8")
+
+# Endpoints that answer for several comma separated symbols at once, with how many fit in
+# one request and how to find each symbol's part of the answer. A lone symbol gets the same
+# answer as its own request would
+BULK_ENDPOINTS = {
+    "profile": (PROFILE_BATCH_SIZE, lambda data: [(record.get("symbol"), [record]) for record in data]),
+    "historicalPrice": (PRICE_BATCH_SIZE, lambda data: [(entry.get("symbol"), entry) for entry in data.get("historicalStockList", [data])]),
+}
+
+# Fills the response cache with the profile and price history of many tickers using a few
+# multi symbol requests, so valuing them afterwards only asks for the endpoints that take
+# one symbol. Tickers that are already cached are left alone, and anything the bulk requests
+# don't return is simply fetched on its own later
+def prefetch(tickerList, priority=BACKGROUND):
+    if OFFLINE_MODE or not CACHE_ENABLED:
+        return
+    with request_priority(priority):
+        for endpoint, (batchSize, split) in BULK_ENDPOINTS.items():
+            ttl = CACHE_TTL_SECONDS.get(cache_key(ENDPOINT_URLS[endpoint])[0], DEFAULT_CACHE_TTL_SECONDS)
+            keys = {ticker: cache_key(ENDPOINT_URLS[endpoint].format(ticker=ticker))[1] for ticker in tickerList}
+            stale = [ticker for ticker in dict.fromkeys(tickerList) if not cache_fresh(keys[ticker], ttl)]
+            for start in range(0, len(stale), batchSize):
+                batch = stale[start:start + batchSize]
+                try:
+                    data = json.loads(scheduled_download(ENDPOINT_URLS[endpoint].format(ticker=",".join(batch))))
+                    parts = split(data)
+                except (OSError, ValueError, TypeError, AttributeError):
+                    continue
+                for symbol, payload in parts:
+                    if symbol in keys:
+                        write_cache(keys[symbol], json.dumps(payload))
+
+# Symbols are handed out in blocks, with each block's bulk endpoints prefetched first
+def prefetched(tickerList, blockSize=PROFILE_BATCH_SIZE):
+    tickers = iter(tickerList)
+    while True:
+        block = list(itertools.islice(tickers, blockSize))
+        if not block:
+            return
+        prefetch(block)
+        yield from block
+
+# Builds the cache key for a URL out of its endpoint path and sorted query parameters.
+# The API key is dropped so it never ends up on disk and changing it doesn't empty the cache
+def cache_key(url):
+    parts = urlsplit(url)
+    path = parts.path.split("/api/", 1)[-1]
+    # e.g. "v3/income-statement/AAPL" -> "income-statement"
+    segments = path.split("/")
+    endpoint = segments[1] if len(segments) > 1 else segments[0]
+    query = sorted((name, value) for name, value in parse_qsl(parts.query) if name.lower() != "apikey")
+    key = path + ("?" + urlencode(query) if query else "")
+    return endpoint, key
+
+cacheLock = threading.Lock()
+cacheState = {"bytes": None}
+
+def cache_path(key):
+    return os.path.join(CACHE_DIRECTORY, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json.gz")
+
+# Returns the parsed cached response, or None if it is missing or older than ttl seconds.
+# A ttl of None accepts any age. Reading an entry marks it as recently used
+def read_cache(key, ttl):
+    path = cache_path(key)
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            header = json.loads(file.readline())
+            if header["key"] != key:
+                return None
+            if ttl is not None and time.time() - header["fetched"] > ttl:
+                return None
+            data = json.loads(file.read())
+        os.utime(path)
+    except (OSError, EOFError, ValueError, KeyError):
+        return None
+    return data
+
+# Whether a fresh response is cached, reading only the header of the entry
+def cache_fresh(key, ttl):
+    try:
+        with gzip.open(cache_path(key), "rt", encoding="utf-8") as file:
+            header = json.loads(file.readline())
+    except (OSError, EOFError, ValueError):
+        return False
+    return header.get("key") == key and (ttl is None or time.time() - header["fetched"] <= ttl)
+
+# Stores a raw response body with a one line header, then evicts old entries if the cache
+# has grown too large. Files are written under a temporary name and renamed into place so
+# a concurrent reader never sees half an entry
+def write_cache(key, text):
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    path = cache_path(key)
+    temporaryPath = path + ".%d.%d.tmp" % (os.getpid(), threading.get_ident())
+    with gzip.open(temporaryPath, "wt", encoding="utf-8") as file:
+        file.write(json.dumps({"key": key, "fetched": time.time()}) + "\n")
+        file.write(text)
+    size = os.path.getsize(temporaryPath)
+    os.replace(temporaryPath, path)
+
+    with cacheLock:
+        if cacheState["bytes"] is None:
+            cacheState["bytes"] = cache_size()
+        else:
+            cacheState["bytes"] += size
+        if cacheState["bytes"] > CACHE_MAX_BYTES:
+            cacheState["bytes"] = evict_cache(int(CACHE_MAX_BYTES * 0.9))
+
+def cache_entries():
+    entries = []
+    for entry in os.scandir(CACHE_DIRECTORY):
+        if entry.name.endswith(".json.gz"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+def cache_size():
+    return sum(size for _, size, _ in cache_entries())
+
+# Deletes the least recently used entries until the cache fits in targetBytes and returns
+# the size that is left
+def evict_cache(targetBytes):
+    entries = sorted(cache_entries())
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= targetBytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+    return total
+
+# Removes every cached response
+def clear_cache():
+    with cacheLock:
+        if os.path.isdir(CACHE_DIRECTORY):
+            for _, _, path in cache_entries():
+                os.remove(path)
+        cacheState["bytes"] = 0
+
+# A ticker's closing prices sorted by date, so the price on any day can be found with a
+# binary search instead of scanning the whole history
+class PriceSeries:
+    def __init__(self, historical):
+        dates = np.array([row["date"][:10] for row in historical], dtype="datetime64[D]")
+        closes = np.array([row["close"] for row in historical], dtype=np.float64)
+        # The API lists the most recent day first
+        order = np.argsort(dates, kind="stable")
+        self.dates = dates[order]
+        self.closes = closes[order]
+
+    # Wraps dates and closes that are already sorted, such as slices of the fundamentals
+    # store, without copying them
+    @classmethod
+    def from_arrays(cls, dates, closes):
+        series = cls.__new__(cls)
+        series.dates = dates
+        series.closes = closes
+        return series
+
+    def __len__(self):
+        return len(self.dates)
+
+    # Returns the (date, close) of the trading day closest to date, or None when there
+    # is no trading day within window days. Ties go to the earlier day
+    def nearest(self, date, window=PRICE_LOOKUP_WINDOW_DAYS):
+        if len(self.dates) == 0:
+            return None
+        target = np.datetime64(date[:10], "D")
+        index = int(np.searchsorted(self.dates, target))
+        best = None
+        for candidate in (index - 1, index):
+            if 0 <= candidate < len(self.dates):
+                distance = abs(int((self.dates[candidate] - target).astype(np.int64)))
+                if best is None or distance < best[0]:
+                    best = (distance, candidate)
+        if best[0] > window:
+            return None
+        return str(self.dates[best[1]]), float(self.closes[best[1]])
+
+# Price histories that have already been downloaded and parsed, least recently used first
+priceStore = OrderedDict()
+priceStoreLock = threading.Lock()
+
+# Returns the parsed price history of a ticker, downloading it the first time it is needed
+def price_series(ticker):
+    with priceStoreLock:
+        series = priceStore.get(ticker)
+        if series is not None:
+            priceStore.move_to_end(ticker)
+            return series
+
+    sharePrice = get_jsonparsed_data(ENDPOINT_URLS["historicalPrice"].format(ticker=ticker))
+    series = PriceSeries(sharePrice.get("historical", []))
+
+    with priceStoreLock:
+        priceStore[ticker] = series
+        priceStore.move_to_end(ticker)
+        while len(priceStore) > PRICE_STORE_SIZE:
+            priceStore.popitem(last=False)
+    return series
+
+# Drops the parsed price history of a ticker, so the next price_series call reads it again
+# from the response cache or the API. Long running processes call it when they reload a
+# ticker, as the store itself never expires
+def forget_price_series(ticker):
+    with priceStoreLock:
+        priceStore.pop(ticker, None)
 
-    for key, value in sharePrice.items():
-        if key == "historical":
-            for index in range(len(value)):
-                if value[index]["date"] in dateRange:
-                    print("Value on", value[index]["date"], ":", value[index]["close"])
-                    return value[index]["close"]
+# This next method is isolated as the API returned the data in a strange format
+# making it difficult to sift through along with the other returned files.
+# As the API doesn't have every single day, the closest trading day within
+# PRICE_LOOKUP_WINDOW_DAYS of the statement's release is used
+@instrumented("share_price")
+def share_price(ticker, metrics):
+    match = price_series(ticker).nearest(metrics["date"])
+    if match is not None:
+        print("Value on", match[0], ":", match[1])
+        return match[1]
 
 # Compares my computed DCF share price to the actual share price on the date of the
 # release of the balance sheet.
@@ -426,6 +1719,530 @@ def compare(computations, sharePrice):
     print("Predicted Share Price :", computations["DCFValuePerShare"])
     print("Difference :", computations["DCFValuePerShare"] - sharePrice)
 
+# Runs the whole valuation for one ticker and returns the computations along with the
+# share price on the day the statements were released
+@instrumented("value_ticker")
+def value_ticker(ticker):
+    session = FetchSession(ticker)
+    data = pull_data(ticker, session)
+    prevData = pull_data_prev_year(ticker, session)
+    metrics = isolate_data(data)
+    sharePrice = share_price(ticker, metrics)
+    metrics["marketCap"] = sharePrice * metrics["outstandingShares"]
+    prevMetrics = isolate_data_prev_year(prevData)
+    return computations(metrics, prevMetrics), sharePrice
+
+# One row of screening output
+def result_row(ticker, computations, sharePrice):
+    difference = computations["DCFValuePerShare"] - sharePrice
+    return {
+        "ticker": ticker,
+        "sharePrice": sharePrice,
+        "DCFValuePerShare": computations["DCFValuePerShare"],
+        "difference": difference,
+        "percentDifference": difference / sharePrice * 100 if sharePrice else float("nan"),
+    }
+
+# Values a list of tickers on a pool of worker threads and yields a row for every ticker that
+# could be computed as soon as it is done. Only a few tickers are in flight at a time, so
+# memory doesn't grow with the length of the list. A ticker that fails only skips that ticker
+def screen_results(tickerList, concurrency=SCREEN_CONCURRENCY):
+    tickers = prefetched(tickerList)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {executor.submit(in_background, value_ticker, ticker): ticker for ticker in itertools.islice(tickers, concurrency * 4)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ticker = pending.pop(future)
+                for nextTicker in itertools.islice(tickers, 1):
+                    pending[executor.submit(in_background, value_ticker, nextTicker)] = nextTicker
+                print(ticker)
+                try:
+                    computation, sharePrice = future.result()
+                    compare(computation, sharePrice)
+                # Account for all possible errors because it will be difficult to make every
+                # possible company work.
+                except (TypeError, IndexError, KeyError, ValueError, ZeroDivisionError) as error:
+                    record_failure(ticker, error)
+                    print("Not Computable With Given Data -", type(error).__name__)
+                    continue
+                # Still throttled or failing after every retry. Other tickers may well get through
+                except OSError as error:
+                    record_failure(ticker, error)
+                    print("Request Failed -", error)
+                    continue
+                yield result_row(ticker, computation, sharePrice)
+
+# Returns the difference between the DCF price and the actual price for every ticker that
+# could be computed, in the order the tickers were given
+def screen_tickers(tickerList, concurrency=SCREEN_CONCURRENCY):
+    results = {row["ticker"]: row["difference"] for row in screen_results(tickerList, concurrency)}
+    return {ticker: results[ticker] for ticker in tickerList if ticker in results}
+
+# Writes screening rows to a JSON lines or CSV file, depending on the extension, flushing
+# every row so the file can be read while the screen is still running
+class ResultWriter:
+    FIELDS = ("ticker", "sharePrice", "DCFValuePerShare", "difference", "percentDifference")
+
+    def __init__(self, path=SCREEN_OUTPUT_PATH):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.writer = None
+        if path.endswith(".csv"):
+            self.writer = csv.DictWriter(self.file, fieldnames=self.FIELDS, extrasaction="ignore")
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.writer is not None:
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+# Keeps the k most undervalued and the k most overvalued tickers seen so far in two bounded
+# min-heaps, so ranking a universe takes the same memory however large it is
+class TopK:
+    def __init__(self, k=SCREEN_TOP_K, rankBy=SCREEN_RANK_BY):
+        self.k = k
+        self.rankBy = rankBy
+        self.undervaluedHeap = []
+        self.overvaluedHeap = []
+
+    def push(self, row):
+        value = row[self.rankBy]
+        if not math.isfinite(value):
+            return
+        for heap, item in ((self.undervaluedHeap, (value, row["ticker"])), (self.overvaluedHeap, (-value, row["ticker"]))):
+            if len(heap) < self.k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    # (ticker, value) pairs, most undervalued first
+    def undervalued(self):
+        return [(ticker, value) for value, ticker in sorted(self.undervaluedHeap, reverse=True)]
+
+    # (ticker, value) pairs, most overvalued first
+    def overvalued(self):
+        return [(ticker, -value) for value, ticker in sorted(self.overvaluedHeap, reverse=True)]
+
+# Groups the statement records of a ticker by the date they were filed for, most recent
+# first. The company profile only exists for today, and the number of shares of past years
+# comes from the enterprise value records since the share float endpoint has no history
+def yearly_records(session):
+    byDate = {}
+    for endpoint in ("incomeStatement", "balanceSheet", "enterpriseValue", "reportedBS"):
+        for record in session.get(endpoint):
+            if record.get("date"):
+                byDate.setdefault(record["date"][:10], {})[endpoint] = record
+
+    profile = session.get("profile")[0]
+    years = []
+    for date in sorted(byDate, reverse=True):
+        records = byDate[date]
+        # Only years with full statements can be valued
+        if "incomeStatement" not in records or "balanceSheet" not in records:
+            continue
+        records["profile"] = profile
+        records["outstandingShares"] = {"outstandingShares": records.get("enterpriseValue", {}).get("numberOfShares")}
+        years.append((date, records))
+    return years
+
+# Values a ticker for every pair of consecutive years in the history that was already
+# downloaded and compares each value with the share price near that year's filing date.
+# All the years are valued together in one batch, then yielded one at a time, most recent
+# first. Years that are missing fields or a share price are left out
+def backtest(ticker, session=None, forecastYears=FORECAST_YEARS, terminalValue=TERMINAL_VALUE):
+    if session is None:
+        session = FetchSession(ticker)
+    years = yearly_records(session)
+    prices = price_series(ticker)
+
+    dates, sharePrices, metricsList, prevMetricsList = [], [], [], []
+    for (date, records), (_, prevRecords) in zip(years, years[1:]):
+        try:
+            metrics = MetricsRecord(extract_metrics(records, CURRENT_YEAR_FIELDS), shared_macro_assumptions())
+            prevMetrics = MetricsRecord(extract_metrics(prevRecords, PREVIOUS_YEAR_FIELDS), shared_macro_assumptions())
+        except MissingFieldsError:
+            continue
+        match = prices.nearest(date)
+        if match is None:
+            continue
+        metrics["marketCap"] = match[1] * metrics["outstandingShares"]
+        dates.append(date)
+        sharePrices.append(match[1])
+        metricsList.append(metrics)
+        prevMetricsList.append(prevMetrics)
+
+    if not dates:
+        return
+    results = batch_computations(MetricsTable.from_records(metricsList), MetricsTable.from_records(prevMetricsList),
+                                 forecastYears, terminalValue)
+    for index, date in enumerate(dates):
+        if not results["valid"][index]:
+            continue
+        value = float(results["DCFValuePerShare"][index])
+        sharePrice = sharePrices[index]
+        yield {
+            "ticker": ticker,
+            "date": date,
+            "DCFValuePerShare": value,
+            "sharePrice": sharePrice,
+            "difference": value - sharePrice,
+            "percentDifference": (value - sharePrice) / sharePrice * 100 if sharePrice else math.nan,
+        }
+
+# Backtests a list of tickers on a pool of worker threads, yielding each ticker's years as
+# soon as that ticker is done. Tickers that can't be valued are skipped as in screen_tickers
+def backtest_tickers(tickerList, concurrency=SCREEN_CONCURRENCY, forecastYears=FORECAST_YEARS, terminalValue=TERMINAL_VALUE):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # The generators only start running once list() consumes them on a worker thread
+        futures = {executor.submit(in_background, list, backtest(ticker, None, forecastYears, terminalValue)): ticker for ticker in tickerList}
+        for future in as_completed(futures):
+            try:
+                rows = future.result()
+            except (TypeError, IndexError, KeyError, ValueError) as error:
+                record_failure(futures[future], error)
+                print(futures[future], "Not Computable With Given Data -", type(error).__name__)
+                continue
+            # Still throttled or failing after every retry. The other tickers carry on
+            except OSError as error:
+                record_failure(futures[future], error)
+                print(futures[future], "Request Failed -", error)
+                continue
+            yield from rows
+
+# Columns kept for every filing in the fundamentals store, next to its date
+STORE_FIELDS = tuple(metric for metric, _, _, _ in CURRENT_YEAR_FIELDS if metric != "date") + ("sharePrice",)
+
+# Layout of the files of a fundamentals store. Stores written before it kept one .npy file
+# per column and are still read, and rewritten in this layout on their first write
+STORE_LAYOUT = "append"
+
+def store_column_dtype(name):
+    return np.dtype("datetime64[D]") if name == "date" else np.dtype(np.float64)
+
+# Slices of a column for a list of (start, stop) segments: a view when there is only one
+def take_segments(column, segments):
+    if len(segments) == 1:
+        return column[segments[0][0]:segments[0][1]]
+    if not segments:
+        return column[:0]
+    return np.concatenate([column[start:stop] for start, stop in segments])
+
+# Fundamentals and price history of a whole universe kept on disk as one raw file per
+# column, memory-mapped on load. A refresh only appends the new rows at the end of the
+# files, so the rows of a ticker can end up in several segments, oldest first; the index
+# keeps where every segment starts and stops and how many rows the files hold. Anything past
+# that count is left over from a write that didn't finish and is cut off by the next one.
+# compact() rewrites the files with every ticker in one segment, so reading a ticker is a
+# slice of the mapped columns rather than a copy. Nothing is read from disk until it's used
+class FundamentalsStore:
+    def __init__(self, directory=STORE_DIRECTORY):
+        self.directory = directory
+        self.layout = STORE_LAYOUT
+        self.rows = {}
+        self.priceRows = {}
+        self.rowCount = self.priceRowCount = 0
+        self.columns = {name: np.empty(0, dtype=store_column_dtype(name)) for name in ("date",) + STORE_FIELDS}
+        self.priceDates = np.empty(0, dtype="datetime64[D]")
+        self.priceCloses = np.empty(0, dtype=np.float64)
+        if os.path.exists(os.path.join(directory, "index.json")):
+            self.load()
+
+    def load(self):
+        with open(os.path.join(self.directory, "index.json")) as file:
+            index = json.load(file)
+        self.layout = index.get("layout")
+        if self.layout == STORE_LAYOUT:
+            self.rows = {ticker: [tuple(segment) for segment in segments] for ticker, segments in index["rows"].items()}
+            self.priceRows = {ticker: [tuple(segment) for segment in segments] for ticker, segments in index["priceRows"].items()}
+        else:
+            self.rows = {ticker: [tuple(rows)] for ticker, rows in index["rows"].items()}
+            self.priceRows = {ticker: [tuple(rows)] for ticker, rows in index["priceRows"].items()}
+        self.rowCount, self.priceRowCount = index["rowCount"], index["priceRowCount"]
+        for name in ("date",) + STORE_FIELDS:
+            self.columns[name] = self.load_column("fundamentals", name, self.rowCount)
+        self.priceDates = self.load_column("prices", "date", self.priceRowCount)
+        self.priceCloses = self.load_column("prices", "close", self.priceRowCount)
+
+    def load_column(self, table, name, rowCount):
+        dtype = store_column_dtype(name)
+        if self.layout != STORE_LAYOUT:
+            # Empty files can't be memory-mapped
+            return np.load(os.path.join(self.directory, table, name + ".npy"), mmap_mode="r" if rowCount else None)
+        if not rowCount:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.directory, table, name + ".bin"), dtype=dtype, mode="r", shape=(rowCount,))
+
+    def __contains__(self, ticker):
+        return ticker in self.rows
+
+    def tickers(self):
+        return list(self.rows)
+
+    def row_count(self, ticker):
+        return sum(stop - start for start, stop in self.rows.get(ticker, ()))
+
+    # Every stored filing of a ticker, oldest first, as views into the store once compacted
+    def fundamentals(self, ticker):
+        segments = self.rows[ticker]
+        return {name: take_segments(column, segments) for name, column in self.columns.items()}
+
+    def price_series(self, ticker):
+        segments = self.priceRows.get(ticker, [])
+        return PriceSeries.from_arrays(take_segments(self.priceDates, segments), take_segments(self.priceCloses, segments))
+
+    def latest_date(self, ticker):
+        if not self.row_count(ticker):
+            return None
+        return self.columns["date"][self.rows[ticker][-1][1] - 1]
+
+    # Columns for every pair of consecutive years of a ticker, ready for batch_computations.
+    # The current and previous years are offset views of the same stored columns
+    def year_pairs(self, ticker):
+        columns = self.fundamentals(ticker)
+        metrics = {name: column[1:] for name, column in columns.items()}
+        prevMetrics = {name: column[:-1] for name, column in columns.items()}
+        metrics["marketCap"] = metrics["sharePrice"] * metrics["outstandingShares"]
+        return metrics, prevMetrics
+
+    # Columns for the latest year of every ticker with at least two stored years, so a whole
+    # universe can be screened straight from disk. Returns the tickers in the same order
+    def latest_year_pairs(self, tickerList=None):
+        if tickerList is None:
+            tickerList = self.tickers()
+        tickerList = [ticker for ticker in tickerList if self.row_count(ticker) >= 2]
+        latest = np.empty(len(tickerList), dtype=np.int64)
+        previous = np.empty(len(tickerList), dtype=np.int64)
+        for position, ticker in enumerate(tickerList):
+            segments = self.rows[ticker]
+            start, stop = segments[-1]
+            latest[position] = stop - 1
+            # The year before can be the last row of the segment before
+            previous[position] = stop - 2 if stop - start >= 2 else segments[-2][1] - 1
+        metrics = {name: column[latest] for name, column in self.columns.items()}
+        prevMetrics = {name: column[previous] for name, column in self.columns.items()}
+        metrics["marketCap"] = metrics["sharePrice"] * metrics["outstandingShares"]
+        return tickerList, metrics, prevMetrics
+
+    # Downloads the filings and prices newer than what is stored for each ticker and writes
+    # them into the store. Tickers already in the store only ask the API for the last few
+    # periods and for prices since the last stored day
+    def refresh(self, tickerList, concurrency=SCREEN_CONCURRENCY):
+        updates = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(in_background, self.fetch_update, ticker): ticker for ticker in tickerList}
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    updates[ticker] = future.result()
+                except (TypeError, IndexError, KeyError, ValueError) as error:
+                    record_failure(ticker, error)
+                    print(ticker, "Not Refreshed -", type(error).__name__)
+                # The API gave up on this ticker, the others are still written
+                except OSError as error:
+                    record_failure(ticker, error)
+                    print(ticker, "Request Failed -", error)
+        if updates:
+            self.write(updates)
+        return sorted(updates)
+
+    def fetch_update(self, ticker):
+        latestDate = self.latest_date(ticker)
+        stored = self.price_series(ticker)
+        if latestDate is None:
+            session = FetchSession(ticker)
+            prices = price_series(ticker)
+        else:
+            # Statements are yearly, so a limit of one more than the number of years since
+            # the last stored filing covers everything newer
+            yearsSince = int((np.datetime64(time.strftime("%Y-%m-%d"), "D") - latestDate).astype(np.int64) // 365)
+            session = FetchSession(ticker, limit=yearsSince + 1)
+            since = str(stored.dates[-1] + 1) if len(stored) else "1900-01-01"
+            payload = get_jsonparsed_data(ENDPOINT_URLS["historicalPrice"].format(ticker=ticker) + "&from=" + since)
+            newPrices = PriceSeries(payload.get("historical", []))
+            newer = newPrices.dates > stored.dates[-1] if len(stored) else slice(None)
+            prices = PriceSeries.from_arrays(np.concatenate([stored.dates, newPrices.dates[newer]]), np.concatenate([stored.closes, newPrices.closes[newer]]))
+
+        rows = []
+        for date, records in yearly_records(session):
+            if latestDate is not None and np.datetime64(date, "D") <= latestDate:
+                continue
+            metrics = extract_metrics(records, CURRENT_YEAR_FIELDS, strict=False)
+            match = prices.nearest(date)
+            metrics["sharePrice"] = match[1] if match is not None else math.nan
+            rows.append((date, metrics))
+        return rows, prices
+
+    # Appends new filings and prices to the end of the column files, then points the index
+    # at them. Prices already stored are not written again
+    def write(self, updates):
+        if self.layout != STORE_LAYOUT:
+            self.compact()
+
+        fundamentals = {name: [] for name in ("date",) + STORE_FIELDS}
+        dates, closes = [], []
+        rows = {ticker: list(segments) for ticker, segments in self.rows.items()}
+        priceRows = {ticker: list(segments) for ticker, segments in self.priceRows.items()}
+        rowCount, priceRowCount = self.rowCount, self.priceRowCount
+
+        for ticker in sorted(updates):
+            newRows, prices = updates[ticker]
+            newRows = sorted(newRows, key=lambda row: row[0])
+            rows.setdefault(ticker, [])
+            if newRows:
+                fundamentals["date"].append(np.array([date for date, _ in newRows], dtype="datetime64[D]"))
+                for name in STORE_FIELDS:
+                    fundamentals[name].append(np.array([metrics.get(name, math.nan) for _, metrics in newRows], dtype=np.float64))
+                rows[ticker].append((rowCount, rowCount + len(newRows)))
+                rowCount += len(newRows)
+
+            stored = self.price_series(ticker)
+            newer = np.asarray(prices.dates > stored.dates[-1]) if len(stored) else np.ones(len(prices), dtype=bool)
+            priceRows.setdefault(ticker, [])
+            if newer.any():
+                dates.append(np.asarray(prices.dates)[newer])
+                closes.append(np.asarray(prices.closes)[newer])
+                priceRows[ticker].append((priceRowCount, priceRowCount + len(dates[-1])))
+                priceRowCount += len(dates[-1])
+
+        # Let go of the memory maps before the files underneath them are cut and extended
+        self.columns = {}
+        self.priceDates = self.priceCloses = None
+        for name, parts in fundamentals.items():
+            self.append_column("fundamentals", name, self.rowCount, parts)
+        self.append_column("prices", "date", self.priceRowCount, dates)
+        self.append_column("prices", "close", self.priceRowCount, closes)
+        self.write_index(self.directory, rowCount, priceRowCount, rows, priceRows)
+        self.load()
+
+    # Adds rows after the first rowCount of a column file, dropping whatever an unfinished
+    # write left behind them
+    def append_column(self, table, name, rowCount, parts):
+        dtype = store_column_dtype(name)
+        path = os.path.join(self.directory, table, name + ".bin")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as file:
+            file.truncate(rowCount * dtype.itemsize)
+            file.seek(0, os.SEEK_END)
+            for part in parts:
+                file.write(np.ascontiguousarray(part, dtype=dtype).tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+    # The index is replaced in one step, so a store always opens with either the old or the
+    # new rows
+    def write_index(self, directory, rowCount, priceRowCount, rows, priceRows):
+        temporary = os.path.join(directory, "index.json.tmp")
+        with open(temporary, "w") as file:
+            json.dump({"layout": STORE_LAYOUT, "rowCount": rowCount, "priceRowCount": priceRowCount, "rows": rows, "priceRows": priceRows}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, os.path.join(directory, "index.json"))
+
+    # Rewrites the store with the rows of every ticker in one segment, in ticker order, and
+    # swaps the new files in place of the old ones. Appends never do this by themselves as it
+    # copies the whole store
+    def compact(self):
+        tickerList = sorted(set(self.rows) | set(self.priceRows))
+        temporaryDirectory = self.directory + ".tmp"
+        shutil.rmtree(temporaryDirectory, ignore_errors=True)
+        os.makedirs(os.path.join(temporaryDirectory, "fundamentals"))
+        os.makedirs(os.path.join(temporaryDirectory, "prices"))
+
+        rows, priceRows = {}, {}
+        rowCount = priceRowCount = 0
+        for ticker in tickerList:
+            count = self.row_count(ticker)
+            rows[ticker] = [(rowCount, rowCount + count)] if count else []
+            rowCount += count
+            count = sum(stop - start for start, stop in self.priceRows.get(ticker, ()))
+            priceRows[ticker] = [(priceRowCount, priceRowCount + count)] if count else []
+            priceRowCount += count
+        # Written ticker by ticker, so no more than one ticker's rows are copied at once
+        columns = [("fundamentals", name, column, self.rows) for name, column in self.columns.items()]
+        columns += [("prices", "date", self.priceDates, self.priceRows), ("prices", "close", self.priceCloses, self.priceRows)]
+        for table, name, column, segments in columns:
+            with open(os.path.join(temporaryDirectory, table, name + ".bin"), "wb") as file:
+                for ticker in tickerList:
+                    file.write(np.ascontiguousarray(take_segments(column, segments.get(ticker, [])), dtype=store_column_dtype(name)).tobytes())
+        self.write_index(temporaryDirectory, rowCount, priceRowCount, rows, priceRows)
+
+        # Let go of the memory maps before the files underneath them are replaced
+        self.columns = {}
+        self.priceDates = self.priceCloses = None
+        oldDirectory = self.directory + ".old"
+        shutil.rmtree(oldDirectory, ignore_errors=True)
+        if os.path.exists(self.directory):
+            os.replace(self.directory, oldDirectory)
+        os.replace(temporaryDirectory, self.directory)
+        shutil.rmtree(oldDirectory, ignore_errors=True)
+        self.load()
+
+# Screens the latest year of every stored ticker (or of the given ones) straight from the
+# fundamentals store, in one batch and without touching the API. Yields the same rows as
+# screen_results, in store order, for every ticker that could be valued
+def screen_store(store, tickerList=None, forecastYears=FORECAST_YEARS, terminalValue=TERMINAL_VALUE):
+    tickerList, metrics, prevMetrics = store.latest_year_pairs(tickerList)
+    if not tickerList:
+        return
+    results = batch_computations(metrics, prevMetrics, forecastYears, terminalValue)
+    sharePrices = metrics["sharePrice"]
+    for index, ticker in enumerate(tickerList):
+        sharePrice = float(sharePrices[index])
+        if results["valid"][index] and math.isfinite(sharePrice):
+            yield result_row(ticker, {"DCFValuePerShare": float(results["DCFValuePerShare"][index])}, sharePrice)
+
+# Pulled from GeeksForGeeks
+# (Poorly) Displays the tickers and disparity between DCF Price and actual. matplotlib is
+# only imported here, as it takes longer to import than the whole valuation takes to run
+# Shows the chart, or saves it to path without needing a display
+def plot_share_price_difference(companyData, path=None, title="Share Price Difference Per Company (NASDAQ)"):
+    companySymbols = list(companyData.keys())
+    sharePriceDifference = list(companyData.values())
+
+    if path is None:
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(figsize=(16, 9))
+    else:
+        # A bare Figure draws with the Agg canvas, pyplot and its GUI backend aren't involved
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=(16, 9))
+        ax = fig.subplots()
+    ax.barh(companySymbols, sharePriceDifference)
+    for s in ['top', 'bottom', 'left', 'right']:
+        ax.spines[s].set_visible(False)
+    ax.xaxis.set_ticks_position('none')
+    ax.yaxis.set_ticks_position('none')
+    ax.xaxis.set_tick_params(pad=15)
+    ax.yaxis.set_tick_params(pad=20)
+    ax.grid(visible=True, color='grey', linestyle='-.', linewidth=0.5, alpha=0.2)
+    ax.invert_yaxis()
+    for i in ax.patches:
+        ax.text(i.get_width() + 0.2, i.get_y() + 0.5, str(round((i.get_width()), 2)), fontsize=6, fontweight='bold', color='grey')
+    ax.set_title(title, loc="left", )
+    fig.text(0.9, 0.15, "Teeron Hajebi Tabrizi", fontsize=12, color="grey", ha="right", va="bottom", alpha=0.7)
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path)
+
+# Charts the most undervalued companies at the top and the most overvalued at the bottom
+def plot_top_k(ranking, path=SCREEN_CHART_PATH):
+    companyData = dict(ranking.undervalued() + ranking.overvalued()[::-1])
+    unit = "%" if ranking.rankBy == "percentDifference" else "$"
+    plot_share_price_difference(companyData, path, "Top %d Undervalued And Overvalued Companies (%s)" % (ranking.k, unit))
+
 # Creates a list comprised of all of the tickers of the companies in the NASDAQ 100.
 def ticker_list():
     NASDAQListURL = "https://financialmodelingprep.com/api/v3/nasdaq_constituent?apikey=<API_KEY>"
@@ -438,67 +2255,37 @@ def ticker_list():
 
     return tickerList
 
+# Every common stock listed on an exchange (e.g. "NASDAQ", "NYSE", "AMEX"), for screening
+# whole exchanges rather than just the NASDAQ-100
+def exchange_ticker_list(exchange="NASDAQ"):
+    stockListURL = "https://financialmodelingprep.com/api/v3/stock/list?apikey=<API_KEY>"
+    stockList = get_jsonparsed_data(stockListURL)
+
+    return sorted({stock["symbol"] for stock in stockList
+                   if stock.get("exchangeShortName") == exchange and stock.get("type", "stock") == "stock" and stock.get("symbol")})
+
 if __name__ == "__main__":
 
     # Loop through tickers to find their DCF valuation disparity
     userInput = True
     if userInput == False:
-        tickerList = ticker_list()
-        companyData = {}
-        for ticker in tickerList:
-            try:
-                print(ticker)
-                data = pull_data(ticker)
-                prevData = pull_data_prev_year(ticker)
-                metrics = isolate_data(data)
-                sharePrice = share_price(ticker, metrics)
-                metrics["marketCap"] = sharePrice * metrics["outstandingShares"]
-                prevMetrics = isolate_data_prev_year(prevData)
-                computation = computations(metrics, prevMetrics)
-                compare(computation, sharePrice)
-                companyData[ticker] = computation["DCFValuePerShare"] - sharePrice
-            # Account for all possible errors because it will be difficult to make every
-            # possible company work.
-            except TypeError:
-                print("Not Computable With Given Data - TypeError")
-            except IndexError:
-                print("Not Computable With Given Data - IndexError")
-            except KeyError:
-                print("Not Computable With Given Data - KeyError")
-            except ValueError:
-                print("Not Computable With Given Data - ValueError")
-
-        #companyData = dict(sorted(companyData.items(), key=lambda item: item[1]))
-
-        companySymbols = list(companyData.keys())
-        sharePriceDifference = list(companyData.values())
-
-        # Pulled from GeeksForGeeks
-        # (Poorly) Displays the tickers and disparity between DCF Price and actual.
-        fig, ax = plt.subplots(figsize=(16, 9))
-        ax.barh(companySymbols, sharePriceDifference)
-        for s in ['top', 'bottom', 'left', 'right']:
-            ax.spines[s].set_visible(False)
-        ax.xaxis.set_ticks_position('none')
-        ax.yaxis.set_ticks_position('none')
-        ax.xaxis.set_tick_params(pad=15)
-        ax.yaxis.set_tick_params(pad=20)
-        ax.grid(b=True, color='grey', linestyle='-.', linewidth=0.5, alpha=0.2)
-        ax.invert_yaxis()
-        for i in ax.patches:
-            plt.text(i.get_width() + 0.2, i.get_y() + 0.5, str(round((i.get_width()), 2)), fontsize=6, fontweight='bold', color='grey')
-        ax.set_title("Share Price Difference Per Company (NASDAQ)", loc="left", )
-        fig.text(0.9, 0.15, "Teeron Hajebi Tabrizi", fontsize=12, color="grey", ha="right", va="bottom", alpha=0.7)
-        plt.show()
+        if SCREEN_FROM_STORE:
+            rows = screen_store(FundamentalsStore(STORE_DIRECTORY))
+        else:
+            rows = screen_results(ticker_list())
+        ranking = TopK(SCREEN_TOP_K, SCREEN_RANK_BY)
+        with ResultWriter(SCREEN_OUTPUT_PATH) as writer:
+            for row in rows:
+                writer.write(row)
+                ranking.push(row)
+
+        plot_top_k(ranking, SCREEN_CHART_PATH)
 
     # For a specific company. (User selected)
     else:
         ticker = input("Input ticker: ")
-        data = pull_data(ticker)
-        prevData = pull_data_prev_year(ticker)
-        metrics = isolate_data(data)
-        sharePrice = share_price(ticker, metrics)
-        metrics["marketCap"] = sharePrice * metrics["outstandingShares"]
-        prevMetrics = isolate_data_prev_year(prevData)
-        computations = computations(metrics, prevMetrics)
-        compare(computations, sharePrice)
+        computation, sharePrice = value_ticker(ticker)
+        compare(computation, sharePrice)
+
+    if INSTRUMENTATION_ENABLED:
+        instrumentation.export()
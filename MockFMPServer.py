@@ -0,0 +1,197 @@
+'''
+A local stand-in for the Financial Modeling Prep API, for trying out screens, the service
+and the request scheduler without an API key or quota.
+
+Every endpoint DiscountedCashFlow.py uses is served from the synthetic payloads of
+Benchmark.py, the same for a symbol on every run. Profiles and price histories can be asked
+for several symbols at once, like the real API. The server can enforce a rate limit, answering
+429 with the API's "Limit Reach" message, and fail a share of requests with server errors.
+
+Usage:
+    python MockFMPServer.py --port 8100 --rate-limit 300 --error-rate 0.02
+    DCF_API_BASE=http://127.0.0.1:8100 python ShardedScreen.py run --exchange NASDAQ
+
+'''
+
+# Imports
+import argparse
+import functools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import DiscountedCashFlow as dcf
+import Benchmark
+
+MOCK_HOST = "127.0.0.1"
+MOCK_PORT = 8100
+
+# Symbols listed by the index and exchange endpoints
+MOCK_UNIVERSE_SIZE = 100
+
+LIMIT_MESSAGE = "Limit Reach . Please upgrade your plan or visit our documentation for more details at https://site.financialmodelingprep.com/"
+
+# Endpoint in the request path -> name of the payload in Benchmark.synthetic_payloads
+PAYLOAD_NAMES = {dcf.cache_key(url)[0]: name for name, url in dcf.ENDPOINT_URLS.items()}
+
+@functools.lru_cache(maxsize=4096)
+def payloads(symbol):
+    return Benchmark.synthetic_payloads(symbol)
+
+# Requests allowed per minute, refilled continuously. Unlike the client's scheduler this
+# never waits: a request either gets a token or is turned away
+class Quota:
+    def __init__(self, ratePerMinute, burst):
+        self.rate = ratePerMinute / 60 if ratePerMinute else None
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Returns 0 when the request may go ahead, otherwise the seconds until it could
+    def take(self):
+        if self.rate is None:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+# The answer of the API for a path and its query parameters, or None if there is no such endpoint
+def respond(path, query, universe):
+    segments = path.split("/api/", 1)[-1].split("/")
+    endpoint = segments[1] if len(segments) > 1 else segments[0]
+    if endpoint == "nasdaq_constituent":
+        return [{"symbol": symbol, "name": symbol, "sector": "Technology"} for symbol in universe]
+    if endpoint == "stock" and segments[-1] == "list":
+        return [{"symbol": symbol, "name": symbol, "exchangeShortName": "NASDAQ", "type": "stock"} for symbol in universe]
+    if endpoint not in PAYLOAD_NAMES:
+        return None
+
+    name = PAYLOAD_NAMES[endpoint]
+    symbols = query["symbol"][0] if "symbol" in query else segments[-1]
+    symbols = [symbol for symbol in symbols.split(",") if symbol]
+    if name == "profile":
+        return [record for symbol in symbols for record in payloads(symbol)["profile"]]
+    if name == "historicalPrice":
+        since = query.get("from", [""])[0]
+        entries = [{"symbol": symbol, "historical": [day for day in payloads(symbol)["historicalPrice"]["historical"] if day["date"] >= since]}
+                   for symbol in symbols]
+        return entries[0] if len(entries) == 1 else {"historicalStockList": entries}
+    if len(symbols) != 1:
+        return {"Error Message": "This endpoint takes a single symbol"}
+    records = payloads(symbols[0])[name]
+    if "limit" in query:
+        records = records[:int(query["limit"][0])]
+    return records
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        server = self.server
+        if parts.path == "/__stats":
+            with server.lock:
+                self.send_json(200, {"requests": dict(server.counts), "throttled": server.throttled, "errors": server.errors})
+            return
+        endpoint = dcf.cache_key(self.path)[0]
+
+        wait = server.quota.take()
+        if wait:
+            with server.lock:
+                server.throttled += 1
+            self.send_json(server.throttleStatus, {"Error Message": LIMIT_MESSAGE}, {"Retry-After": "%.3f" % wait})
+            return
+        with server.lock:
+            server.counts[endpoint] = server.counts.get(endpoint, 0) + 1
+            failing = server.random.random() < server.errorRate
+            if failing:
+                server.errors += 1
+        if failing:
+            self.send_json(503, {"Error Message": "Service unavailable"})
+            return
+        if server.latency:
+            time.sleep(server.latency)
+
+        body = respond(parts.path, parse_qs(parts.query), server.universe)
+        if body is None:
+            self.send_json(404, {"Error Message": "Unknown endpoint"})
+        else:
+            self.send_json(200, body)
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+# throttleStatus is 429 by default. 200 mimics the older API, which reported a spent quota
+# in the body of a normal response
+class MockFMPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=(MOCK_HOST, MOCK_PORT), ratePerMinute=None, burst=10, errorRate=0.0, latency=0.0,
+                 universeSize=MOCK_UNIVERSE_SIZE, throttleStatus=429, seed=0):
+        super().__init__(address, MockHandler)
+        self.quota = Quota(ratePerMinute, burst)
+        self.errorRate = errorRate
+        self.latency = latency
+        self.universe = Benchmark.ticker_names(universeSize)
+        self.throttleStatus = throttleStatus
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.throttled = 0
+        self.errors = 0
+
+    @property
+    def base_url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+# Starts a server on a free port in a background thread and points DiscountedCashFlow at it.
+# Returns the server; call shutdown() and server_close() on it when done
+def start(**options):
+    server = MockFMPServer((MOCK_HOST, 0), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    dcf.API_BASE_URL = server.base_url
+    return server
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Serve synthetic Financial Modeling Prep responses")
+    parser.add_argument("--host", default=MOCK_HOST)
+    parser.add_argument("--port", type=int, default=MOCK_PORT)
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests allowed per minute")
+    parser.add_argument("--burst", type=int, default=10, help="requests allowed at once after a quiet spell")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--universe", type=int, default=MOCK_UNIVERSE_SIZE, help="symbols in the listing endpoints")
+    parser.add_argument("--throttle-status", type=int, default=429, choices=(200, 429))
+    arguments = parser.parse_args(arguments)
+
+    server = MockFMPServer((arguments.host, arguments.port), arguments.rate_limit, arguments.burst, arguments.error_rate,
+                           arguments.latency, arguments.universe, arguments.throttle_status)
+    print("Serving a mock Financial Modeling Prep API on " + server.base_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
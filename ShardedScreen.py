@@ -0,0 +1,219 @@
+'''
+Screens a whole exchange (or any list of tickers) on a pool of processes, optionally split
+into shards so several machines can each take a share of the universe.
+
+Every valued ticker is appended to a results file as soon as its chunk finishes, so an
+interrupted screen picks up where it stopped when run again with the same arguments.
+Tickers that fail because of their data are recorded too and not retried; tickers that fail
+because of the network are left out and tried again on the next run.
+
+Usage:
+    python ShardedScreen.py run --exchange NASDAQ --shards 4 --shard 0
+    python ShardedScreen.py merge screen.shard*-of-4.jsonl --output screen.jsonl
+
+'''
+
+# Imports
+import argparse
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import DiscountedCashFlow as dcf
+
+# Processes valuing tickers, and the number of tickers handed to a process at once. A chunk
+# is only written to the results file once it is done, so smaller chunks lose less work
+SHARD_WORKERS = os.cpu_count() or 1
+SHARD_CHUNK_SIZE = 25
+
+# Stable across processes and machines, unlike hash()
+def shard_of(ticker, shardCount):
+    return zlib.crc32(ticker.encode("utf-8")) % shardCount
+
+def shard_tickers(tickerList, shardIndex=0, shardCount=1):
+    return sorted({ticker for ticker in tickerList if shard_of(ticker, shardCount) == shardIndex})
+
+def checkpoint_path(output, shardIndex=0, shardCount=1):
+    return "%s.shard%d-of-%d.jsonl" % (output, shardIndex, shardCount)
+
+# Reads the records of a results file. A line cut short by a crash is ignored, so the ticker
+# it belonged to is valued again
+def read_results(path):
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and "ticker" in record:
+                records.append(record)
+    return records
+
+# Whether the last run stopped in the middle of a line, so the next record has to start on a fresh one
+def cut_short(path):
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return False
+    with open(path, "rb") as file:
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) != b"\n"
+
+# Values one ticker into a results record, or returns None when the API couldn't be reached
+def value_record(ticker):
+    try:
+        computation, sharePrice = dcf.value_ticker(ticker)
+    # Same errors the screening loop skips: the company's data can't be valued
+    except (TypeError, IndexError, KeyError, ValueError, ZeroDivisionError) as error:
+        dcf.record_failure(ticker, error)
+        return {"ticker": ticker, "error": type(error).__name__}
+    except OSError as error:
+        dcf.record_failure(ticker, error)
+        return None
+    return dcf.result_row(ticker, computation, sharePrice)
+
+# Runs in a worker process. The requests of a chunk still go out on threads since most of
+# the time is spent waiting on the API. Returns the records along with what the chunk
+# counted for the instrumentation, which only the parent exports
+def value_chunk(tickers, concurrency=dcf.SCREEN_CONCURRENCY):
+    dcf.prefetch(tickers)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        records = [record for record in executor.map(lambda ticker: dcf.in_background(value_record, ticker), tickers) if record is not None]
+    return records, dcf.instrumentation.drain() if dcf.INSTRUMENTATION_ENABLED else None
+
+# Worker processes get the settings of the parent even when they aren't forked. The API's
+# rate limit is split between them since each process has its own scheduler, and they count
+# from zero rather than from whatever a forked parent had counted already
+def configure_worker(cacheDirectory, offlineMode, apiBaseURL, ratePerMinute, workers, instrumentationEnabled):
+    dcf.CACHE_DIRECTORY = cacheDirectory
+    dcf.OFFLINE_MODE = offlineMode
+    dcf.API_BASE_URL = apiBaseURL
+    dcf.INSTRUMENTATION_ENABLED = instrumentationEnabled
+    dcf.instrumentation = dcf.Instrumentation()
+    dcf.scheduler = dcf.RequestScheduler(ratePerMinute / workers if ratePerMinute else None, max(1, dcf.RATE_LIMIT_BURST // workers))
+
+# Screens the tickers of one shard, appending to its results file, and returns the path of
+# that file. Tickers already in the file are skipped
+def run_shard(tickerList, output, shardIndex=0, shardCount=1, workers=SHARD_WORKERS, chunkSize=SHARD_CHUNK_SIZE):
+    path = checkpoint_path(output, shardIndex, shardCount)
+    done = {record["ticker"] for record in read_results(path)}
+    remaining = [ticker for ticker in shard_tickers(tickerList, shardIndex, shardCount) if ticker not in done]
+    print("Shard %d of %d: %d tickers done, %d to go" % (shardIndex, shardCount, len(done), len(remaining)))
+    if not remaining:
+        return path
+
+    cutShort = cut_short(path)
+    chunks = [remaining[start:start + chunkSize] for start in range(0, len(remaining), chunkSize)]
+    with open(path, "a", encoding="utf-8") as file, \
+            ProcessPoolExecutor(max_workers=workers, initializer=configure_worker,
+                                initargs=(dcf.CACHE_DIRECTORY, dcf.OFFLINE_MODE, dcf.API_BASE_URL, dcf.RATE_LIMIT_PER_MINUTE, workers,
+                                          dcf.INSTRUMENTATION_ENABLED)) as executor:
+        if cutShort:
+            file.write("\n")
+        futures = [executor.submit(value_chunk, chunk) for chunk in chunks]
+        for completed, future in enumerate(as_completed(futures), 1):
+            records, counts = future.result()
+            if counts is not None:
+                dcf.instrumentation.merge(counts)
+            file.writelines(json.dumps(record) + "\n" for record in records)
+            file.flush()
+            os.fsync(file.fileno())
+            print("Chunk %d of %d, %d valued" % (completed, len(chunks), sum("error" not in record for record in records)))
+    return path
+
+# Screens the tickers of one shard from a fundamentals store rather than the API, appending
+# to the same results file run_shard uses. The whole shard is valued in one batch, so there
+# is no process pool, and tickers the store can't value are recorded as failures
+def run_store_shard(store, tickerList, output, shardIndex=0, shardCount=1):
+    path = checkpoint_path(output, shardIndex, shardCount)
+    done = {record["ticker"] for record in read_results(path)}
+    remaining = [ticker for ticker in shard_tickers(tickerList, shardIndex, shardCount) if ticker not in done]
+    print("Shard %d of %d: %d tickers done, %d to go" % (shardIndex, shardCount, len(done), len(remaining)))
+    if not remaining:
+        return path
+
+    records = {row["ticker"]: row for row in dcf.screen_store(store, remaining)}
+    for ticker in remaining:
+        if ticker not in records:
+            records[ticker] = {"ticker": ticker, "error": "NotComputable" if ticker in store else "NotInStore"}
+    cutShort = cut_short(path)
+    with open(path, "a", encoding="utf-8") as file:
+        if cutShort:
+            file.write("\n")
+        file.writelines(json.dumps(records[ticker]) + "\n" for ticker in remaining)
+        file.flush()
+        os.fsync(file.fileno())
+    print("%d valued from the store" % sum("error" not in record for record in records.values()))
+    return path
+
+# Merges results files into one, sorted by ticker. A ticker is taken from the first file it
+# appears in, in the order the paths sort, so the merge doesn't depend on which shard
+# finished first or on the order the files were given in. Returns the difference between the
+# DCF price and the actual price of every valued ticker, like screen_tickers
+def merge_results(paths, output=None):
+    merged = {}
+    for path in sorted(paths):
+        for record in read_results(path):
+            merged.setdefault(record["ticker"], record)
+
+    records = [merged[ticker] for ticker in sorted(merged)]
+    if output is not None:
+        temporary = output + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(record) + "\n" for record in records)
+        os.replace(temporary, output)
+    return {record["ticker"]: record["difference"] for record in records if "error" not in record}
+
+def read_ticker_file(path):
+    with open(path, encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip()]
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Screen large ticker universes with checkpoints")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="screen one shard of a universe")
+    universe = run.add_mutually_exclusive_group()
+    universe.add_argument("--exchange", help="every stock on this exchange, e.g. NASDAQ or NYSE")
+    universe.add_argument("--tickers", help="file with one ticker per line")
+    run.add_argument("--shard", type=int, default=0, help="index of this shard")
+    run.add_argument("--shards", type=int, default=1, help="number of shards the universe is split into")
+    run.add_argument("--workers", type=int, default=SHARD_WORKERS, help="worker processes")
+    run.add_argument("--chunk-size", type=int, default=SHARD_CHUNK_SIZE, help="tickers per task")
+    run.add_argument("--output", default="screen", help="prefix of the results file")
+    run.add_argument("--store", help="value from this fundamentals store instead of the API")
+
+    merge = commands.add_parser("merge", help="merge results files into one")
+    merge.add_argument("paths", nargs="+")
+    merge.add_argument("--output", default="screen.jsonl")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.command == "merge":
+        differences = merge_results(arguments.paths, arguments.output)
+        print("Merged %d valued tickers into %s" % (len(differences), arguments.output))
+        return
+
+    if not 0 <= arguments.shard < arguments.shards:
+        parser.error("--shard has to be between 0 and --shards - 1")
+    store = dcf.FundamentalsStore(arguments.store) if arguments.store else None
+    if arguments.tickers:
+        tickerList = read_ticker_file(arguments.tickers)
+    elif arguments.exchange:
+        tickerList = dcf.exchange_ticker_list(arguments.exchange)
+    elif store is not None:
+        tickerList = store.tickers()
+    else:
+        tickerList = dcf.ticker_list()
+    try:
+        if store is not None:
+            print(run_store_shard(store, tickerList, arguments.output, arguments.shard, arguments.shards))
+        else:
+            print(run_shard(tickerList, arguments.output, arguments.shard, arguments.shards, arguments.workers, arguments.chunk_size))
+    finally:
+        if dcf.INSTRUMENTATION_ENABLED:
+            dcf.instrumentation.export()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+'''
+A long running HTTP/JSON service around DiscountedCashFlow.py.
+
+Parsed fundamentals and share prices are kept in a bounded in-memory LRU, so repeated
+valuations of the same tickers skip the API entirely. Concurrent requests for a ticker
+that is not cached yet are coalesced into a single upstream fetch.
+
+Endpoints:
+    GET /value/<ticker>                 valuation of one ticker
+    GET /batch?tickers=AAPL,MSFT,...    valuations streamed as JSON lines as they finish
+    POST /batch {"tickers": [...]}      same as above
+    GET /stats                          cache statistics
+    GET /health
+
+/value and /batch accept forecastYears and terminalValue query parameters, as in
+DiscountedCashFlow.computations.
+
+Usage:
+    python ValuationService.py --port 8000
+
+'''
+
+# Imports
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import DiscountedCashFlow as dcf
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8000
+
+# Number of tickers whose fundamentals are kept in memory, and for how many seconds
+SERVICE_CACHE_SIZE = 1024
+SERVICE_CACHE_TTL_SECONDS = 60 * 60
+
+# Tickers fetched at the same time for batch requests. Batches are fetched with background
+# priority so they don't hold up single ticker requests
+SERVICE_CONCURRENCY = 16
+
+# Status of a valuation that failed, other than the 422 used for data that can't be valued.
+# UpstreamError covers the API failing or being unreachable after the retries
+ERROR_STATUS = {"RateLimitError": 503, "UpstreamError": 502}
+
+# Loads what a valuation needs for a ticker: the current and previous year metrics, with
+# the market cap filled in from the share price near the filing date. They are cached as
+# plain dicts, which computations reads faster than records. The price history is read again
+# too, otherwise a new filing could be matched against prices that stop before it
+def load_fundamentals(ticker):
+    dcf.forget_price_series(ticker)
+    session = dcf.FetchSession(ticker)
+    metrics = dcf.isolate_data(dcf.pull_data(ticker, session))
+    prevMetrics = dcf.isolate_data_prev_year(dcf.pull_data_prev_year(ticker, session))
+    match = dcf.price_series(ticker).nearest(metrics["date"])
+    if match is None:
+        raise ValueError("No share price near " + metrics["date"])
+    metrics["marketCap"] = match[1] * metrics["outstandingShares"]
+    return metrics.as_dict(), prevMetrics.as_dict(), match[1]
+
+# Bounded LRU of loaded fundamentals. While a ticker is being loaded, every other request
+# for it waits on the same load instead of starting its own
+class FundamentalsCache:
+    def __init__(self, capacity=SERVICE_CACHE_SIZE, ttl=SERVICE_CACHE_TTL_SECONDS, loader=load_fundamentals):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.loading = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def get(self, ticker):
+        with self.lock:
+            entry = self.entries.get(ticker)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self.entries.move_to_end(ticker)
+                self.stats["hits"] += 1
+                return entry[1]
+            future = self.loading.get(ticker)
+            waiting = future is not None
+            if waiting:
+                self.stats["coalesced"] += 1
+            else:
+                future = self.loading[ticker] = Future()
+                self.stats["misses"] += 1
+        if waiting:
+            return future.result()
+
+        try:
+            value = self.loader(ticker)
+        except BaseException as error:
+            with self.lock:
+                del self.loading[ticker]
+            future.set_exception(error)
+            raise
+        with self.lock:
+            self.entries[ticker] = (time.monotonic(), value)
+            self.entries.move_to_end(ticker)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            del self.loading[ticker]
+        future.set_result(value)
+        return value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, size=len(self.entries), capacity=self.capacity)
+
+# Values a ticker from the cache and returns the response body. Tickers that can't be valued
+# come back with the error instead, like the screening loop skips them, and so do tickers
+# whose data couldn't be downloaded
+def valuation(cache, ticker, forecastYears=None, terminalValue=dcf.TERMINAL_VALUE):
+    try:
+        metrics, prevMetrics, sharePrice = cache.get(ticker)
+        computation = dcf.computations(metrics, prevMetrics, forecastYears, terminalValue)
+    except (TypeError, IndexError, KeyError, ValueError, ZeroDivisionError, dcf.RateLimitError) as error:
+        dcf.record_failure(ticker, error)
+        return {"ticker": ticker, "error": type(error).__name__, "message": str(error)}
+    except OSError as error:
+        dcf.record_failure(ticker, error)
+        return {"ticker": ticker, "error": "UpstreamError", "message": "%s: %s" % (type(error).__name__, error)}
+    return {
+        "ticker": ticker,
+        "date": metrics["date"],
+        "sharePrice": sharePrice,
+        "DCFValuePerShare": computation["DCFValuePerShare"],
+        "difference": computation["DCFValuePerShare"] - sharePrice,
+        "computations": computation,
+    }
+
+class ValuationHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if parts.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif parts.path == "/stats":
+            self.send_json(200, self.server.cache.snapshot())
+        elif parts.path.startswith("/value/"):
+            options = self.valuation_options(query)
+            if options is not None:
+                result = valuation(self.server.cache, parts.path[len("/value/"):].upper(), *options)
+                self.send_json(ERROR_STATUS.get(result.get("error"), 422) if "error" in result else 200, result)
+        elif parts.path == "/batch":
+            tickers = [ticker for value in query.get("tickers", []) for ticker in value.split(",") if ticker]
+            self.stream_batch(tickers, query)
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        if parts.path != "/batch":
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            tickers = list(body["tickers"])
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {"error": "Expected a JSON body with a list of tickers"})
+            return
+        self.stream_batch(tickers, parse_qs(parts.query))
+
+    def valuation_options(self, query):
+        try:
+            forecastYears = int(query["forecastYears"][0]) if "forecastYears" in query else None
+        except ValueError:
+            self.send_json(400, {"error": "forecastYears has to be a whole number"})
+            return None
+        terminalValue = query.get("terminalValue", [dcf.TERMINAL_VALUE])[0]
+        if terminalValue == "none":
+            terminalValue = None
+        return forecastYears, terminalValue
+
+    # Sends one JSON line per ticker as soon as it is valued, using chunked encoding so the
+    # client can read them before the whole batch is done
+    def stream_batch(self, tickers, query):
+        options = self.valuation_options(query)
+        if options is None:
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        futures = {self.server.executor.submit(dcf.in_background, valuation, self.server.cache, ticker.upper(), *options): ticker.upper()
+                   for ticker in dict.fromkeys(tickers)}
+        for future in as_completed(futures):
+            # Anything valuation doesn't turn into an error record would otherwise cut the
+            # response short in the middle of the chunked body
+            try:
+                result = future.result()
+            except Exception as error:
+                result = {"ticker": futures[future], "error": type(error).__name__, "message": str(error)}
+            line = (json.dumps(result) + "\n").encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class ValuationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cache, concurrency=SERVICE_CONCURRENCY):
+        super().__init__(address, ValuationHandler)
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Serve DCF valuations over HTTP")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--cache-size", type=int, default=SERVICE_CACHE_SIZE, help="tickers kept in memory")
+    parser.add_argument("--ttl", type=float, default=SERVICE_CACHE_TTL_SECONDS, help="seconds a ticker stays cached")
+    parser.add_argument("--concurrency", type=int, default=SERVICE_CONCURRENCY, help="tickers fetched at once for batches")
+    arguments = parser.parse_args(arguments)
+
+    # The price store has to hold at least as many tickers as the fundamentals cache
+    dcf.PRICE_STORE_SIZE = max(dcf.PRICE_STORE_SIZE, arguments.cache_size)
+    server = ValuationServer((arguments.host, arguments.port), FundamentalsCache(arguments.cache_size, arguments.ttl), arguments.concurrency)
+    print("Serving valuations on http://%s:%d" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if dcf.INSTRUMENTATION_ENABLED:
+            dcf.instrumentation.export()
+
+if __name__ == "__main__":
+    main()